@@ -0,0 +1,58 @@
+#################################################
+## file         : line_counter.py
+## description  : per-chunk cost of line accounting
+##                while streaming, old vs incremental
+##
+#################################################
+
+import time
+import random
+from gpt_repl.render import LineCounter, count_lines
+
+words = ["the", "model", "`code`", "**bold**", "\x1b[1;92mgreen\x1b[0m", "tab\t", "宽字符", "streaming"]
+
+def synthetic_deltas(num_tokens: int):
+    random.seed(0)
+    for i in range(num_tokens):
+        delta = random.choice(words) + " "
+        if i % 40 == 39:
+            delta += "\n\n"
+        yield delta
+
+
+def bench_full_rescan(num_tokens: int, sample_every: int):
+    # what main.py used to do: count_lines() over everything printed so far
+    output = ""
+    samples = []
+    for i, delta in enumerate(synthetic_deltas(num_tokens)):
+        output += delta
+        start = time.perf_counter()
+        count_lines(output)
+        if i % sample_every == 0:
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_incremental(num_tokens: int, sample_every: int):
+    counter = LineCounter(width=120)
+    samples = []
+    for i, delta in enumerate(synthetic_deltas(num_tokens)):
+        start = time.perf_counter()
+        counter.feed(delta).rows
+        if i % sample_every == 0:
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(name: str, samples: list, num_tokens: int):
+    quarter = max(1, len(samples) // 4)
+    first = sum(samples[:quarter]) / quarter
+    last = sum(samples[-quarter:]) / quarter
+    print(f"{name:<12} {num_tokens:>7} tokens   first 25%: {first * 1e6:8.2f} us/chunk   last 25%: {last * 1e6:8.2f} us/chunk")
+
+
+if __name__ == "__main__":
+    for num_tokens in (1_000, 10_000, 100_000):
+        report("incremental", bench_incremental(num_tokens, 10), num_tokens)
+    for num_tokens in (1_000, 10_000):
+        report("full rescan", bench_full_rescan(num_tokens, 10), num_tokens)
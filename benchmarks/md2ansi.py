@@ -0,0 +1,72 @@
+#################################################
+## file         : md2ansi.py
+## description  : markdown rendering throughput
+##                (MB of markdown per second), whole
+##                replies and streamed deltas
+##
+#################################################
+
+import time
+import random
+from gpt_repl.render import md2ansi, MarkdownStream
+
+words = ["the", "model", "`code`", "**bold**", "__also bold__", "streaming", "renderer", "terminal",
+         "a-hyphenated-word", "宽字符", "emoji😀", "x" * 30]
+
+def paragraph(num_words: int):
+    return " ".join(random.choice(words) for _ in range(num_words))
+
+
+def synthetic_reply(num_blocks: int):
+    # roughly what a model reply looks like: headers, prose, lists and fenced code
+    random.seed(0)
+    blocks = []
+    for i in range(num_blocks):
+        kind = i % 5
+        if kind == 0:
+            blocks.append("## " + paragraph(4))
+        elif kind == 1:
+            blocks.append(paragraph(random.randint(10, 80)))
+        elif kind == 2:
+            blocks.append("\n".join("- " + paragraph(random.randint(3, 20)) for _ in range(4)))
+        elif kind == 3:
+            blocks.append("\n".join(f"{n}. " + paragraph(random.randint(3, 20)) for n in range(1, 4)))
+        else:
+            language = random.choice(["python", "bash", "js", "nosuchlang"])
+            blocks.append(f"```{language}\ndef f(x):\n    return x * 2  # {paragraph(3)}\n\nprint(f(21))\n```")
+    return "\n\n".join(blocks)
+
+
+def best_of(runs: int, fn, *args):
+    # the fastest run is the least disturbed by whatever else the machine is doing
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def render_whole(md: str):
+    md2ansi(md, width=100)
+
+
+def render_streamed(deltas: list):
+    stream = MarkdownStream(width=100)
+    for delta in deltas:
+        stream.feed(delta)
+    stream.finish()
+
+
+def report(name: str, seconds: float, num_bytes: int):
+    print(f"{name:<10} {num_bytes / 1e3:>8.1f} kB   {seconds * 1e3:8.2f} ms   {num_bytes / seconds / 1e6:6.2f} MB/s")
+
+
+if __name__ == "__main__":
+    md2ansi("```python\nwarm_up = 1\n```")  # first call pays for the pygments imports
+    for num_blocks, runs in ((10, 50), (100, 10), (1_000, 5)):
+        md = synthetic_reply(num_blocks)
+        deltas = [md[i:i + 8] for i in range(0, len(md), 8)]
+        num_bytes = len(md.encode())
+        report("whole", best_of(runs, render_whole, md), num_bytes)
+        report("streamed", best_of(runs, render_streamed, deltas), num_bytes)
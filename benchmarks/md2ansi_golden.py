@@ -0,0 +1,140 @@
+#################################################
+## file         : md2ansi_golden.py
+## description  : md2ansi output checked against a
+##                golden corpus, whole and streamed
+##
+#################################################
+
+# python benchmarks/md2ansi_golden.py            check, exits 1 on any difference
+# python benchmarks/md2ansi_golden.py --update   rewrite the golden file from the current md2ansi
+#
+# golden/md2ansi.jsonl holds {"md", "width", "ansi"} records. they were made with md2ansi as it
+# was before it was precompiled (user-014), so this checks the renderer still prints exactly what
+# it always has. only --update after a change to the output that's meant to happen. pygments
+# colors the code blocks, a different pygments version can change those bytes
+
+import os
+import sys
+import json
+import random
+import argparse
+
+here = os.path.dirname(os.path.abspath(__file__))
+golden_path = os.path.join(here, "golden", "md2ansi.jsonl")
+widths = [7, 20, 80, 133]
+
+# lines that have tripped up a markdown engine, or could
+cases = [
+    "",
+    "plain text",
+    "# header\n## header two\n###### six\n####### seven\n#nospace",
+    "**bold** and __bold__ and **unclosed and __mixed**__",
+    "`code` and `more code` and `unclosed",
+    "`**not bold**` but **`code in bold`**",
+    "- item\n* item\n+ item\n  - nested\n-nospace\n- ",
+    "1. one\n2. two\n10. ten\n1.nospace\n3) paren",
+    "```python\ndef f(x):\n    return x * 2\n```",
+    "```\nno language\n```",
+    "``` js \nconsole.log(1)\n```",
+    "```nosuchlang\nwhat\n```",
+    "```python\nunclosed fence\nstill code",
+    "text\n```\ncode\n```\ntext after",
+    "   ```python\nindented fence\n   ```",
+    "tabs\there\tand\tthere",
+    "trailing spaces   \n   leading spaces",
+    "a-very-long-hyphenated-word-that-should-not-break-on-hyphens-at-all ok",
+    "x" * 300,
+    "宽字符宽字符宽字符 wide characters 宽字符 and emoji 😀😀😀 mixed in",
+    "escape \x1b[31mred\x1b[0m in the text",
+    "line with\x0bvertical tab and\x0cform feed",
+    "1NL1NECODE placeholder text `and code`",
+    "**bold `code` bold** then `a` `b` `c`",
+    "## header with `code` and **bold**",
+    "- list with `code` and **bold** and a long tail " + "word " * 40,
+    "\n\n\nblank lines\n\n\n",
+    "> quote\n---\n| table | row |\n|---|---|",
+    "\\*escaped\\* stars * lone star * and ** double",
+    "____ ** ** __ __",
+]
+
+words = ["the", "model", "`code`", "**bold**", "__also bold__", "streaming", "renderer", "terminal",
+         "a-hyphenated-word", "宽字符", "emoji😀", "x" * 30, "`un", "**", "\t", "  "]
+
+def paragraph(rng, num_words: int):
+    return " ".join(rng.choice(words) for _ in range(num_words))
+
+
+def generated(seed: int):
+    rng = random.Random(seed)
+    blocks = []
+    for _ in range(rng.randint(1, 8)):
+        kind = rng.randrange(6)
+        if kind == 0:
+            blocks.append("#" * rng.randint(1, 7) + " " + paragraph(rng, 4))
+        elif kind == 1:
+            blocks.append(paragraph(rng, rng.randint(1, 60)))
+        elif kind == 2:
+            blocks.append("\n".join(rng.choice("-*+") + " " + paragraph(rng, rng.randint(1, 20)) for _ in range(3)))
+        elif kind == 3:
+            blocks.append("\n".join(f"{n}. " + paragraph(rng, rng.randint(1, 20)) for n in range(1, 4)))
+        elif kind == 4:
+            language = rng.choice(["python", "bash", "", "nosuchlang"])
+            blocks.append(f"```{language}\ndef f(x):\n\treturn x * 2  # {paragraph(rng, 3)}\n```")
+        else:
+            blocks.append("\n".join(paragraph(rng, rng.randint(0, 6)) for _ in range(3)))
+    return "\n\n".join(blocks)
+
+
+def corpus():
+    return cases + [generated(seed) for seed in range(30)]
+
+
+def streamed(md: str, width: int, seed: int):
+    # fed in random deltas, the way replies arrive
+    from gpt_repl.render import MarkdownStream
+    rng = random.Random(seed)
+    stream = MarkdownStream(width=width)
+    output, i = "", 0
+    while i < len(md):
+        step = rng.randint(1, 12)
+        output += stream.feed(md[i:i + step])
+        i += step
+    return output + stream.finish()
+
+
+def check():
+    from gpt_repl.render import md2ansi
+    with open(golden_path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    failed = 0
+    for n, record in enumerate(records):
+        md, width, expected = record["md"], record["width"], record["ansi"]
+        for how, output in (("whole", md2ansi(md, width=width)), ("streamed", streamed(md, width, n))):
+            if output != expected:
+                failed += 1
+                if failed <= 5:
+                    print(f"record {n} ({how}, width {width}) differs\n  md:       {md[:80]!r}\n"
+                          f"  expected: {expected[:120]!r}\n  got:      {output[:120]!r}")
+    print(f"{len(records)} documents and widths, whole and streamed: {failed} differ")
+    return failed == 0
+
+
+def update():
+    from gpt_repl.render import md2ansi
+    os.makedirs(os.path.dirname(golden_path), exist_ok=True)
+    with open(golden_path, "w", encoding="utf-8") as f:
+        for md in corpus():
+            for width in widths:
+                f.write(json.dumps({"md": md, "width": width, "ansi": md2ansi(md, width=width)}, ensure_ascii=False) + "\n")
+    print(f"wrote {golden_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="check md2ansi against its golden output")
+    parser.add_argument("--update", action="store_true", help="rewrite the golden file from the current md2ansi")
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.dirname(here))
+    if args.update:
+        update()
+    else:
+        sys.exit(0 if check() else 1)
@@ -0,0 +1,191 @@
+#################################################
+## file         : mock_server.py
+## description  : local openai-compatible server
+##                that streams synthetic markdown
+##                at a set pace, for benchmarks and
+##                offline testing
+##
+#################################################
+
+# python benchmarks/mock_server.py --port 8000 --tokens 500 --rate 80
+# then in gpt.conf: model = openai/mock, api_base = http://127.0.0.1:8000/v1
+# (litellm wants some OPENAI_API_KEY to be set, any value works)
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+words = ["the", "model", "`code`", "**bold**", "streaming", "renderer", "terminal", "response", "a",
+         "of", "to", "and", "is", "latency", "token", "markdown", "宽字符", "cache", "*italic*"]
+
+code_lines = ["def handle(request):", "    data = json.loads(request.body)", "    if not data:",
+              "        return None", "    for key, value in data.items():", "        print(f\"{key}: {value}\")",
+              "    return data  # done", "", "result = handle(request)"]
+
+def synthetic_blocks(code_density: float, rng: random.Random):
+    # an endless reply: headers, prose, lists and, `code_density` of the time, fenced code
+    i = 0
+    while True:
+        if i and rng.random() < code_density:
+            language = rng.choice(["python", "bash", "js"])
+            yield f"```{language}\n" + "\n".join(rng.choice(code_lines) for _ in range(rng.randint(3, 12))) + "\n```"
+        elif i % 6 == 0:
+            yield "## " + " ".join(rng.choice(words) for _ in range(rng.randint(2, 6)))
+        elif i % 6 == 3:
+            yield "\n".join("- " + " ".join(rng.choice(words) for _ in range(rng.randint(3, 15))) for _ in range(rng.randint(2, 5)))
+        else:
+            yield " ".join(rng.choice(words) for _ in range(rng.randint(15, 80)))
+        i += 1
+
+
+def synthetic_tokens(num_tokens: int, code_density: float, seed: int = 0):
+    # a token is a word plus the whitespace after it, blocks are finished past num_tokens so
+    # fences are always closed
+    rng = random.Random(seed)
+    tokens = []
+    for block in synthetic_blocks(code_density, rng):
+        if tokens:
+            tokens[-1] += "\n\n"
+        start = 0
+        for i, char in enumerate(block[:-1]):
+            if char in " \n" and block[i + 1] not in " \n":
+                tokens.append(block[start:i + 1])
+                start = i + 1
+        tokens.append(block[start:])
+        if len(tokens) >= num_tokens:
+            return tokens
+
+
+class MockSettings:
+
+    def __init__(self, tokens: int = 500, rate: float = 80, chunk_tokens: int = 1, code_density: float = 0.3,
+                 ttft: float = 0.2, seed: int = 0):
+        self.tokens = tokens
+        self.rate = rate                   # tokens per second, 0 = as fast as possible
+        self.chunk_tokens = chunk_tokens
+        self.code_density = code_density   # share of blocks that are fenced code
+        self.ttft = ttft                   # seconds before the first chunk
+        self.seed = seed
+
+    def reply(self):
+        # (chunks, number of tokens)
+        tokens = synthetic_tokens(self.tokens, self.code_density, self.seed)
+        return ["".join(tokens[i:i + self.chunk_tokens]) for i in range(0, len(tokens), self.chunk_tokens)], len(tokens)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"  # keep-alive, like a real provider
+
+    def do_POST(self):
+        received = time.perf_counter()
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            return self.send_json(404, {"error": {"message": f"no route {self.path}"}})
+
+        settings = self.server.settings
+        chunks, num_tokens = settings.reply()
+        model = body.get("model", "mock")
+        usage = {"prompt_tokens": sum(len(str(m.get("content", "")).split()) for m in body.get("messages", [])),
+                 "completion_tokens": num_tokens}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": model}
+
+        if not body.get("stream"):
+            time.sleep(settings.ttft + (num_tokens / settings.rate if settings.rate else 0))
+            self.send_json(200, {**base, "object": "chat.completion", "usage": usage, "choices": [{
+                "index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "".join(chunks)}}]})
+            self.server.record(received, len(chunks), 0)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        sent = 0
+        start = received + settings.ttft
+        for i, content in enumerate(chunks):
+            # chunks are paced from the start, so slow writes don't add up to a slower rate
+            due = start + (i * settings.chunk_tokens / settings.rate if settings.rate else 0)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            delta = {"role": "assistant", "content": content} if i == 0 else {"content": content}
+            sent += self.send_event({**base, "object": "chat.completion.chunk",
+                                     "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        sent += self.send_event({**base, "object": "chat.completion.chunk", "usage": usage,
+                                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        sent += self.send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+        self.server.record(received, len(chunks), sent)
+
+    def do_GET(self):
+        # /stats: timing of the last completion, so a client can subtract the mock's own latency
+        if self.path.rstrip("/").endswith("/stats"):
+            return self.send_json(200, self.server.last)
+        self.send_json(404, {"error": {"message": f"no route {self.path}"}})
+
+    def send_event(self, data):
+        payload = ("data: " + (data if isinstance(data, str) else json.dumps(data)) + "\n\n").encode()
+        self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+        self.wfile.flush()
+        return len(payload)
+
+    def send_json(self, code: int, data):
+        payload = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, settings: MockSettings, port: int = 0):
+        super().__init__(("127.0.0.1", port), MockHandler)
+        self.settings = settings
+        self.last = {}
+        self.lock = threading.Lock()
+
+    @property
+    def api_base(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def record(self, received: float, chunks: int, num_bytes: int):
+        with self.lock:
+            self.last = {"seconds": round(time.perf_counter() - received, 6), "chunks": chunks, "bytes": num_bytes}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="openai-compatible mock server that streams synthetic markdown")
+    parser.add_argument("--port", type=int, default=8000, help="0 picks a free port")
+    parser.add_argument("--tokens", type=int, default=500, help="tokens per reply")
+    parser.add_argument("--rate", type=float, default=80, help="tokens per second, 0 = as fast as possible")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="tokens per streamed chunk")
+    parser.add_argument("--code-density", type=float, default=0.3, help="share of blocks that are fenced code (0-1)")
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first chunk")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = MockServer(MockSettings(args.tokens, args.rate, args.chunk_tokens, args.code_density, args.ttft, args.seed), args.port)
+    # the first line tells whoever started us where to connect
+    print(server.api_base, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit()
@@ -0,0 +1,106 @@
+#################################################
+## file         : screen_bytes.py
+## description  : bytes written to the terminal
+##                per streamed response, clearing
+##                and reprinting vs screen.Screen,
+##                and the status line while waiting
+##
+#################################################
+
+import io
+import os
+import time
+import random
+from types import SimpleNamespace
+import gpt_repl.render
+import gpt_repl.screen
+import gpt_repl.spinner
+from gpt_repl.render import LineCounter, rule_str
+from gpt_repl.screen import Screen
+from gpt_repl.spinner import StatusLine
+
+# a fixed terminal size, so the numbers don't depend on where this runs
+width, height = 100, 40
+gpt_repl.render.terminal_size = gpt_repl.screen.terminal_size = gpt_repl.spinner.terminal_size = lambda: os.terminal_size((width, height))
+
+words = ["the", "model", "`code`", "**bold**", "streaming", "terminal", "宽字符", "response"]
+
+def synthetic_deltas(num_tokens: int):
+    random.seed(0)
+    for i in range(num_tokens):
+        delta = random.choice(words) + " "
+        if i % 40 == 39:
+            delta += "\n\n"
+        yield delta
+
+
+def clear_lines(out, num_lines: int):
+    if num_lines > 0:
+        out.write(f"\x1b[{num_lines}A")
+        out.write("\r\x1b[J")
+
+
+def stream_clear_and_reprint(num_tokens: int):
+    # what main.py used to do for the raw renderer: print deltas, wipe everything whenever it
+    # gets close to a screenful, then wipe again and print the whole reply when it's done
+    out = io.StringIO()
+    header = "\x1b[1m\x1b[97mopenai/gpt-4o-mini:\x1b[0m "
+    prefix = "\n\x1b[1m\x1b[97mopenai/gpt-4o-mini:\x1b[0m\n\n"
+    out.write(prefix)
+    counter = LineCounter(width)
+    reply = []
+    for delta in synthetic_deltas(num_tokens):
+        reply.append(delta)
+        out.write(delta)
+        num_lines = counter.feed(delta).rows
+        if num_lines > height - 10:
+            clear_lines(out, num_lines - 1)
+            counter.reset()
+    clear_lines(out, counter.feed(prefix).rows - 1)
+    out.write(f"\n{header}{''.join(reply)}\n{rule_str('white')}\n\n")
+    return len(out.getvalue().encode())
+
+
+def stream_screen(num_tokens: int):
+    out = io.StringIO()
+    screen = Screen(out, sync=True)
+    header = "\x1b[1m\x1b[97mopenai/gpt-4o-mini:\x1b[0m "
+    screen.write("\n" + header)
+    reply = []
+    for delta in synthetic_deltas(num_tokens):
+        reply.append(delta)
+        screen.write(delta)
+    screen.update(f"\n{header}{''.join(reply)}\n{rule_str('white')}\n\n")
+    return screen.bytes_written
+
+
+def spinner_clear_and_reprint(frames: int):
+    return sum(len(f"\r {cursor}") + len("\r ") for cursor in ("|/-\\" * frames)[:frames])
+
+
+def spinner_status_line(frames: int):
+    # the StatusLine that replaced the spinner, on a fake clock so it takes no real time. its
+    # thread isn't started, each frame is one of its 0.1s ticks while waiting for the reply
+    now = [0.0]
+    gpt_repl.spinner.time = SimpleNamespace(perf_counter=lambda: now[0])
+    out = io.StringIO()
+    status = StatusLine(out)
+    status.run = lambda: None
+    status.start("openai/gpt-4o-mini")
+    for _ in range(frames):
+        now[0] += 0.1
+        status._draw()
+    status.stop()
+    gpt_repl.spinner.time = time
+    return len(out.getvalue().encode())
+
+
+if __name__ == "__main__":
+    print(f"terminal {width}x{height}\n")
+    for num_tokens in (100, 1_000, 10_000):
+        before = stream_clear_and_reprint(num_tokens)
+        after = stream_screen(num_tokens)
+        print(f"streamed reply {num_tokens:>6} tokens   before: {before:>9} bytes   after: {after:>9} bytes   ({before / after:.2f}x)")
+    before = spinner_clear_and_reprint(100)
+    after = spinner_status_line(100)
+    print(f"status line, 10 seconds      before: {before:>9} bytes   after: {after:>9} bytes   ({before / after:.2f}x)")
@@ -0,0 +1,78 @@
+#################################################
+## file         : store_dedup.py
+## description  : disk used by many similar chats in
+##                the old per-chat files vs the
+##                message store, via `gpt --migrate`
+##
+#################################################
+
+# python benchmarks/store_dedup.py [--chats 200]
+#
+# the chats are written the way chat.py used to (messages.json, chat.md and chat.idx) under a
+# throwaway home, like a week of asking variations of the same thing: they share a long
+# system prompt and pasted context, and most go on from a common first turn
+
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+
+words = ["the", "model", "`code`", "**bold**", "streaming", "terminal", "response", "memory", "\n\n"]
+
+def text(num_words: int):
+    return " ".join(random.choice(words) for _ in range(num_words))
+
+
+def write_legacy_chat(chats_dir, i: int, messages: list, model: str):
+    chat_dir = os.path.join(chats_dir, f"240101_{i:06d}_{model.replace('/', '_')}")
+    os.makedirs(chat_dir)
+    with open(os.path.join(chat_dir, "messages.json"), "w") as f:
+        json.dump(messages, f, indent=2)
+    turns = []
+    for message in messages:
+        if message["role"] == "user":
+            turns.append(f": {message['content']}\n\n")
+        elif message["role"] == "assistant":
+            turns[-1] += f"\x1b[1m{model}:\x1b[0m {message['content']}\n\n"
+    offsets, offset = [], 0
+    for turn in turns:
+        offsets.append(f"{offset}\n")
+        offset += len(turn.encode())
+    with open(os.path.join(chat_dir, "chat.md"), "w") as f:
+        f.write("".join(turns))
+    with open(os.path.join(chat_dir, "chat.idx"), "w") as f:
+        f.write("".join(offsets))
+    with open(os.path.join(chat_dir, "title.txt"), "w") as f:
+        f.write(f"{messages[1]['content'][:28]} [{model.split('/')[1]}]")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="disk used by similar chats before and after moving them into the store")
+    parser.add_argument("--chats", type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(0)
+    system = {"role": "system", "content": text(300)}
+    context = {"role": "user", "content": "here's the file:\n" + text(1500)}
+    first_reply = {"role": "assistant", "content": text(400)}
+
+    with tempfile.TemporaryDirectory() as home:
+        os.environ["HOME"] = home
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from gpt_repl.config import get_chats_dir
+        from gpt_repl.chat import migrate_chats
+
+        chats_dir = get_chats_dir()
+        for i in range(args.chats):
+            messages = [system, context]
+            if i % 4:  # a retried or forked conversation: same start, it goes elsewhere after
+                messages = messages + [first_reply]
+            else:
+                messages = messages + [{"role": "assistant", "content": text(400)}]
+            for _ in range(random.randint(1, 4)):
+                messages += [{"role": "user", "content": text(30)}, {"role": "assistant", "content": text(300)}]
+            write_legacy_chat(chats_dir, i, messages, "openai/gpt-4o-mini")
+
+        migrate_chats()
@@ -0,0 +1,66 @@
+#################################################
+## file         : stream_memory.py
+## description  : peak memory of reading a long
+##                streamed reply, keeping every chunk
+##                for stream_chunk_builder vs folding
+##                them in a StreamAccumulator
+##
+#################################################
+
+import os
+import time
+import random
+import tracemalloc
+
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")  # stay offline
+
+import litellm
+from litellm import stream_chunk_builder
+from litellm.types.utils import ModelResponseStream, StreamingChoices, Delta
+from gpt_repl.backend import StreamAccumulator
+
+words = ["the", "model", "`code`", "**bold**", "streaming", "terminal", "response", "memory", "\n\n"]
+
+def synthetic_stream(num_tokens: int):
+    # litellm's own chunk objects, made one at a time like a real stream hands them out
+    random.seed(0)
+    for i in range(num_tokens):
+        last = i == num_tokens - 1
+        yield ModelResponseStream(model="gpt-4o-mini", choices=[StreamingChoices(
+            index=0, delta=Delta(content=random.choice(words) + " "), finish_reason="stop" if last else None)])
+
+
+def keep_chunks(num_tokens: int):
+    # what main.py did before
+    chunks = []
+    for chunk in synthetic_stream(num_tokens):
+        chunks.append(chunk)
+    return stream_chunk_builder(chunks).choices[0].message.content
+
+
+def fold_chunks(num_tokens: int):
+    reply = StreamAccumulator()
+    for chunk in synthetic_stream(num_tokens):
+        reply.add(chunk)
+    return reply.response("gpt-4o-mini", [{"role": "user", "content": "hi"}]).choices[0].message.content
+
+
+def measure(fn, num_tokens: int):
+    tracemalloc.start()
+    start = time.perf_counter()
+    content = fn(num_tokens)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, seconds, content
+
+
+if __name__ == "__main__":
+    litellm.suppress_debug_info = True
+    fold_chunks(10)  # token counting loads its tokenizer on the first call
+    for num_tokens in (1_000, 10_000, 50_000):
+        before, before_seconds, kept = measure(keep_chunks, num_tokens)
+        after, after_seconds, folded = measure(fold_chunks, num_tokens)
+        assert kept == folded
+        print(f"{num_tokens:>6} tokens   chunks kept: {before / 1e6:7.2f} MB {before_seconds:6.2f}s"
+              f"   folded: {after / 1e6:7.2f} MB {after_seconds:6.2f}s   ({before / after:.1f}x less memory)")
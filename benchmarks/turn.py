@@ -0,0 +1,216 @@
+#################################################
+## file         : turn.py
+## description  : whole turns (request, streaming
+##                loop, rendering, save_chat) against
+##                the local mock server, results kept
+##                as json to compare runs over time
+##
+#################################################
+
+# python benchmarks/turn.py                      every renderer x every profile
+# python benchmarks/turn.py -r lite -p chat,long --runs 5
+# python benchmarks/turn.py --compare benchmarks/results/<earlier run>.json
+#
+# per scenario, the median over the runs of:
+#   overhead_ms     end-to-end turn time minus the mock's own time for the same request
+#   cpu_per_chunk   process cpu time per streamed chunk
+#   terminal_bytes  bytes written to the (fake, 100x40) terminal
+#   peak_rss_mb     max resident memory of the process that ran the turns
+# every scenario runs in a fresh process, so imports and peak memory don't carry over
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import urllib.request
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# server settings per profile, see mock_server.MockSettings
+profiles = {
+    "chat":  {"tokens": 300,   "rate": 100, "chunk_tokens": 1, "code_density": 0.2, "ttft": 0.1},
+    "code":  {"tokens": 800,   "rate": 200, "chunk_tokens": 1, "code_density": 0.8, "ttft": 0.1},
+    "long":  {"tokens": 4_000, "rate": 800, "chunk_tokens": 4, "code_density": 0.3, "ttft": 0.1},
+    "burst": {"tokens": 2_000, "rate": 0,   "chunk_tokens": 1, "code_density": 0.3, "ttft": 0},
+}
+renderers = ["lite", "rich", "raw"]
+width, height = 100, 40
+model = "openai/mock"
+
+
+class Terminal(io.TextIOBase):
+    # stands in for sys.stdout: counts what would have reached the terminal and drops it
+
+    encoding = "utf-8"
+
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, text: str):
+        self.bytes += len(text.encode())
+        return len(text)
+
+    def isatty(self):
+        return True
+
+
+### one scenario, in its own process #########
+
+def run_scenario(renderer: str, api_base: str, runs: int):
+    import litellm
+    from litellm import completion
+    from gpt_repl.main import request_reply
+    from gpt_repl.chat import mkdir_new_chat, save_chat
+    from gpt_repl.spinner import StatusLine
+    from gpt_repl.metrics import TurnMetrics
+
+    litellm.suppress_debug_info = True  # the mock model isn't in litellm's price list
+    real_stdout = sys.stdout
+    terminal = sys.stdout = Terminal()
+    status = StatusLine(out=terminal)
+    kwargs = {"api_base": api_base, "api_key": "mock"}
+
+    def turn(user_input: str):
+        messages = [{"role": "user", "content": user_input}]
+        turn = TurnMetrics(model)
+        status.start(model)
+        content, rendered = request_reply(completion, model, messages, "white", renderer,
+                                          True, status, turn, completion_kwargs=kwargs)
+        messages.append({"role": "assistant", "content": content})
+        with turn.span("save"):
+            save_chat(mkdir_new_chat(model, user_input), messages, model)
+        return turn
+
+    turn("warm up")  # litellm, httpx and the renderer load lazily on the first request
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    samples = []
+    for i in range(runs):
+        written = terminal.bytes
+        cpu = time.process_time()
+        start = time.perf_counter()
+        record = turn(f"run {i}").record()
+        end = time.perf_counter()
+        cpu = time.process_time() - cpu
+        mock = json.load(urllib.request.urlopen(api_base + "/stats"))
+        samples.append({
+            "overhead_ms": (end - start - mock["seconds"]) * 1e3,
+            "turn_ms": (end - start) * 1e3,
+            "mock_ms": mock["seconds"] * 1e3,
+            "ttft_ms": (record["ttft"] or 0) * 1e3,
+            "render_ms": record["spans"].get("render", 0) * 1e3,
+            "save_ms": record["spans"].get("save", 0) * 1e3,
+            "cpu_per_chunk_us": cpu / max(mock["chunks"], 1) * 1e6,
+            "terminal_bytes": terminal.bytes - written,
+            "chunks": mock["chunks"],
+        })
+
+    sys.stdout = real_stdout
+    result = {name: round(statistics.median(sample[name] for sample in samples), 3) for name in samples[0]}
+    # ru_maxrss is in kB on linux, bytes on macos
+    scale = 1 if sys.platform == "darwin" else 1024
+    result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6, 1)
+    result["rss_growth_mb"] = round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) * scale / 1e6, 1)
+    return result
+
+
+### the suite ################################
+
+def start_mock(profile: dict):
+    args = [f"--{name.replace('_', '-')}={value}" for name, value in profile.items()]
+    server = subprocess.Popen([sys.executable, os.path.join(here, "mock_server.py"), "--port=0", *args],
+                              stdout=subprocess.PIPE, text=True)
+    return server, server.stdout.readline().strip()
+
+
+def run_suite(names: list, renderer_names: list, runs: int):
+    import tempfile
+    results = []
+    with tempfile.TemporaryDirectory() as home:
+        # chats are saved under a throwaway home, the terminal size is fixed, rich is told it has a
+        # terminal and litellm doesn't go online for its price list
+        env = {**os.environ, "HOME": home, "COLUMNS": str(width), "LINES": str(height), "FORCE_COLOR": "1",
+               "LITELLM_LOCAL_MODEL_COST_MAP": "True",
+               "PYTHONPATH": os.pathsep.join(filter(None, [os.path.dirname(here), os.environ.get("PYTHONPATH")]))}
+        for name in names:
+            server, api_base = start_mock(profiles[name])
+            try:
+                for renderer in renderer_names:
+                    child = subprocess.run([sys.executable, __file__, "--scenario", renderer, "--api-base", api_base,
+                                            "--runs", str(runs)], env=env, capture_output=True, text=True)
+                    if child.returncode:
+                        sys.stderr.write(f"{name}/{renderer} failed:\n{child.stderr}\n")
+                        continue
+                    result = {"profile": name, "renderer": renderer, **profiles[name], **json.loads(child.stdout)}
+                    results.append(result)
+                    report(result)
+            finally:
+                server.terminate()
+                server.wait()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def report(result: dict, earlier: dict = None):
+    line = (f"{result['profile']:<6} {result['renderer']:<5}"
+            f"  overhead {result['overhead_ms']:8.2f} ms"
+            f"  cpu/chunk {result['cpu_per_chunk_us']:7.1f} us"
+            f"  terminal {int(result['terminal_bytes']):>8} B"
+            f"  peak rss {result['peak_rss_mb']:6.1f} MB")
+    if earlier:
+        changes = []
+        for name in ("overhead_ms", "cpu_per_chunk_us", "terminal_bytes", "peak_rss_mb"):
+            if earlier.get(name):
+                changes.append(f"{name} {(result[name] - earlier[name]) / earlier[name] * 100:+.0f}%")
+        line += "\n" + " " * 13 + "vs earlier: " + ", ".join(changes)
+    print(line, flush=True)
+
+
+def compare(path: str, earlier_path: str):
+    with open(path) as f, open(earlier_path) as g:
+        now, then = json.load(f), json.load(g)
+    print(f"\n{now['commit']} vs {then['commit']}\n")
+    earlier = {(result["profile"], result["renderer"]): result for result in then["results"]}
+    for result in now["results"]:
+        report(result, earlier.get((result["profile"], result["renderer"])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="end-to-end turn benchmarks against a local mock server")
+    parser.add_argument("-p", "--profiles", default=",".join(profiles), help=f"comma separated, from: {', '.join(profiles)}")
+    parser.add_argument("-r", "--renderers", default=",".join(renderers), help="comma separated")
+    parser.add_argument("--runs", type=int, default=3, help="measured turns per scenario (after one warm-up)")
+    parser.add_argument("--out", help="where to write the json results (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--compare", metavar="EARLIER_JSON", help="compare this run against an earlier one")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)  # a renderer, run in a child process
+    parser.add_argument("--api-base", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        print(json.dumps(run_scenario(args.scenario, args.api_base, args.runs)))
+        sys.exit()
+
+    print(f"terminal {width}x{height}, {args.runs} runs per scenario, medians\n")
+    results = run_suite(args.profiles.split(","), args.renderers.split(","), args.runs)
+    commit = git_commit()
+    out = args.out or os.path.join(here, "results", f"{time.strftime('%Y%m%d-%H%M%S')}-{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump({"time": time.time(), "commit": commit, "python": platform.python_version(),
+                   "platform": platform.platform(), "runs": args.runs, "terminal": [width, height],
+                   "results": results}, f, indent=1)
+    print(f"\nsaved to {out}")
+    if args.compare:
+        compare(out, args.compare)
@@ -0,0 +1,171 @@
+#################################################
+## file         : backend.py
+## description  : where completions come from, the
+##                warm daemon or litellm imported
+##                in this process
+##
+#################################################
+
+import sys
+import threading
+import importlib
+from gpt_repl import tracing
+from types import SimpleNamespace
+
+class Backend:
+    """
+    with the daemon enabled it's spawned (if needed) at startup so it warms up while the user
+    types. otherwise, or if the daemon can't be reached, litellm is imported in a background thread
+    """
+
+    def __init__(self, use_daemon: bool = False, idle_timeout: float = 1800):
+        self.load_thread = None
+        self.daemon = None
+        if use_daemon:
+            from gpt_repl.daemon import DaemonClient
+            self.daemon = DaemonClient(idle_timeout)
+            self.daemon.start()
+        else:
+            self.load_in_process()
+
+    def load_in_process(self):
+        self.load_thread = threading.Thread(target=importlib.import_module, args=("litellm",), daemon=True)
+        self.load_thread.start()
+
+    def get_completion(self, in_process: bool = False):
+        # returns a litellm-style completion function. in_process skips the daemon, for callers
+        # that need more of litellm than the daemon serves (e.g. acompletion for fan-out)
+        if self.daemon and not in_process:
+            if self.daemon.wait():
+                return self.daemon.completion
+            self.daemon = None
+
+        if self.load_thread is None:
+            self.load_in_process()
+        with tracing.span("load_thread.join"):
+            self.load_thread.join()
+        from litellm import completion
+        return completion
+
+
+### litellm-shaped objects ##################
+
+# responses that don't come straight from litellm (the daemon, the response cache) are built
+# from these, so main() can treat every response the same way
+
+def make_chunk(content: str, finish_reason=None, usage=None):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content), finish_reason=finish_reason)], usage=usage)
+
+
+def make_response(content: str, finish_reason="stop", usage=None):
+    message = SimpleNamespace(role="assistant", content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason=finish_reason)], usage=usage)
+
+
+def usage_dict(usage):
+    if not usage:
+        return None
+    return {key: getattr(usage, key, None) for key in ("prompt_tokens", "completion_tokens", "total_tokens")}
+
+
+def response_from(record: dict):
+    # record: {"content", "finish_reason", "usage"}
+    usage = SimpleNamespace(**record["usage"]) if record.get("usage") else None
+    return make_response(record["content"], record.get("finish_reason"), usage)
+
+
+def count_usage(model: str, messages: list, text: str):
+    # litellm's token counts for a stream that didn't report usage, what stream_chunk_builder
+    # used to work out. None without litellm loaded (e.g. the daemon's stub backend)
+    if "litellm" not in sys.modules:
+        return None
+    from litellm import token_counter
+    try:
+        prompt_tokens = token_counter(model=model, messages=messages)
+        completion_tokens = token_counter(model=model, text=text, count_response_tokens=True)
+    except Exception:
+        return None
+    return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens)
+
+
+class StreamAccumulator:
+    """
+    folds a streamed response into its final message as the chunks arrive, so no chunk is kept
+    once it's been read: content, finish_reason, usage and tool call fragments. chunks can be
+    litellm's or the make_chunk() ones, and a chunk carrying the whole message as `final`
+    (the daemon, the response cache) wins over what was folded
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.finish_reason = None
+        self.usage = None
+        self.tool_calls = {}    # index -> {"id", "type", "function": {"name", "arguments"}}
+        self.final = None
+        self.chunks = 0
+
+    def add(self, chunk):
+        # returns the chunk's text
+        self.chunks += 1
+        if getattr(chunk, "final", None):
+            self.final = chunk.final
+        self.usage = getattr(chunk, "usage", None) or self.usage
+        if not chunk.choices:
+            return ""  # e.g. openai's usage-only last chunk
+        choice = chunk.choices[0]
+        self.finish_reason = getattr(choice, "finish_reason", None) or self.finish_reason
+        delta = choice.delta
+        content = delta.content or ""
+        if content:
+            self.parts.append(content)
+        for call in getattr(delta, "tool_calls", None) or ():
+            self.add_tool_call(call)
+        return content
+
+    def add_tool_call(self, call):
+        # a call's id and name come in its first fragment, the json arguments are spread over the rest
+        index = getattr(call, "index", None) or 0
+        folded = self.tool_calls.setdefault(index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+        folded["id"] = getattr(call, "id", None) or folded["id"]
+        function = getattr(call, "function", None)
+        if function:
+            folded["function"]["name"] += getattr(function, "name", None) or ""
+            folded["function"]["arguments"] += getattr(function, "arguments", None) or ""
+
+    def text(self):
+        return "".join(self.parts)
+
+    def response(self, model: str = None, messages: list = None):
+        # the whole reply, shaped like a non-streamed response. a stream that didn't report
+        # usage gets litellm's count when model is given
+        if self.final:
+            return response_from(self.final)
+        text = self.text()
+        usage = self.usage or (count_usage(model, messages or [], text) if model else None)
+        response = make_response(text, self.finish_reason, usage)
+        if self.tool_calls:
+            response.choices[0].message.tool_calls = [
+                SimpleNamespace(id=call["id"], type=call["type"], function=SimpleNamespace(**call["function"]))
+                for _, call in sorted(self.tool_calls.items())]
+        return response
+
+
+interrupted_marker = "[response interrupted with ctrl-c]"
+
+def interrupted_suffix(partial: str):
+    # what's added to a reply cut short by ctrl-c: a closing fence if it stopped inside a
+    # code block, then a marker, so the saved chat (and the model, next turn) can tell
+    fences = sum(1 for line in partial.split('\n') if line.strip().startswith('```'))
+    return ("\n```" if fences % 2 else "") + "\n\n" + interrupted_marker
+
+
+def close_stream(stream):
+    # stop a streamed response early and release its connection. litellm's stream wrapper
+    # has no close() of its own, the provider stream under it (e.g. openai.Stream) does
+    for obj in (stream, getattr(stream, "completion_stream", None)):
+        close = getattr(obj, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception:
+                pass
@@ -0,0 +1,195 @@
+#################################################
+## file         : batch.py
+## description  : non-interactive batch mode,
+##                `gpt --batch in.jsonl --out out.jsonl`
+##
+#################################################
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+from gpt_repl.backend import usage_dict
+
+# input lines:  {"id": ..., "prompt": "..."} or {"id": ..., "messages": [...]},
+#               optionally with "model" and "system"
+# output lines: {"id", "model", "content", "usage", "latency", "attempts"} or {"id", "model", "error", "attempts"}
+# ids that already have a successful line in the output file are skipped, so a killed run
+# can just be started again. failed ids are retried and get a new line
+
+retryable_errors = ("RateLimitError", "APIConnectionError", "Timeout", "InternalServerError", "ServiceUnavailableError")
+
+class RateLimiter:
+    # spaces out request starts to at most `per_second` for one provider
+
+    def __init__(self, per_second: float):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def parse_rate_limits(limits: str):
+    # "openai: 5, anthropic: 2" -> {"openai": 5.0, "anthropic": 2.0}
+    rates = {}
+    for item in limits.split(','):
+        if ':' in item:
+            provider, rate = item.split(':', 1)
+            rates[provider.strip()] = float(rate)
+    return rates
+
+
+def load_jobs(in_path: str, default_model: str, system_prompt: str = None):
+    jobs = []
+    with open(in_path, "r") as f:
+        for line_num, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            messages = record.get("messages") or [{"role": "user", "content": record["prompt"]}]
+            system = record.get("system", system_prompt)
+            if system and messages[0].get("role") != "system":
+                messages = [{"role": "system", "content": system}] + messages
+            jobs.append({
+                "id": record.get("id", line_num),
+                "model": record.get("model", default_model),
+                "messages": messages,
+            })
+    return jobs
+
+
+def completed_ids(out_path: str):
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from a killed run
+            if "error" not in record:
+                done.add(record["id"])
+    return done
+
+
+class BatchRunner:
+
+    def __init__(self, out_file, workers: int, rate_limits: dict, retries: int, completion_kwargs: dict, save_chats: bool):
+        self.out_file = out_file
+        self.semaphore = asyncio.Semaphore(workers)
+        self.rate_limits = rate_limits
+        self.limiters = {}
+        self.retries = retries
+        self.completion_kwargs = completion_kwargs
+        self.save_chats = save_chats
+        self.done = 0
+        self.failed = 0
+        self.total = 0
+
+    def limiter(self, model: str):
+        provider = model.split('/')[0]
+        if provider not in self.limiters:
+            self.limiters[provider] = RateLimiter(self.rate_limits.get(provider, 0))
+        return self.limiters[provider]
+
+    async def run_job(self, acompletion, job: dict):
+        async with self.semaphore:
+            start = time.monotonic()
+            for attempt in range(1, self.retries + 2):
+                await self.limiter(job["model"]).wait()
+                try:
+                    response = await acompletion(model=job["model"], messages=job["messages"], **self.completion_kwargs)
+                    break
+                except Exception as e:
+                    if type(e).__name__ not in retryable_errors or attempt > self.retries:
+                        self.failed += 1
+                        self.write({"id": job["id"], "model": job["model"], "error": f"{type(e).__name__}: {e}", "attempts": attempt})
+                        return
+                    # exponential backoff with jitter, so retries from many workers don't line up
+                    await asyncio.sleep(min(60.0, 2 ** (attempt - 1)) * (0.5 + random.random()))
+
+        content = response.choices[0].message.content
+        usage = getattr(response, "usage", None)
+        if self.save_chats:
+            # saved before the result line, a job whose chat couldn't be saved is failed and rerun on resume
+            try:
+                save_batch_chat(job, content)
+            except Exception as e:
+                self.failed += 1
+                self.write({"id": job["id"], "model": job["model"], "error": f"saving chat: {type(e).__name__}: {e}", "attempts": attempt})
+                return
+        self.done += 1
+        self.write({
+            "id": job["id"],
+            "model": job["model"],
+            "content": content,
+            "usage": usage_dict(usage),
+            "latency": round(time.monotonic() - start, 3),
+            "attempts": attempt,
+        })
+
+    def write(self, record: dict):
+        # one line per result as soon as it's done, so a crash loses at most the jobs in flight
+        self.out_file.write(json.dumps(record) + "\n")
+        self.out_file.flush()
+        self.progress()
+
+    def progress(self):
+        sys.stderr.write(f"\r{self.done + self.failed}/{self.total} done, {self.failed} failed")
+        sys.stderr.flush()
+
+    async def run(self, jobs):
+        from litellm import acompletion
+        self.total = len(jobs)
+        self.progress()
+        await asyncio.gather(*(self.run_job(acompletion, job) for job in jobs))
+        sys.stderr.write("\n")
+
+
+def save_batch_chat(job: dict, content: str):
+    from gpt_repl.chat import new_chat_dir, init_chat, save_chat
+
+    messages = job["messages"] + [{"role": "assistant", "content": content}]
+    user_input = job["messages"][-1]["content"]
+    chat_dir = new_chat_dir(job["model"])
+    try:
+        init_chat(chat_dir, job["model"], user_input)
+        save_chat(chat_dir, messages, job["model"])
+    except BaseException:
+        # don't leave a half made chat in the list, the catalog drops it on its next sync
+        shutil.rmtree(chat_dir, ignore_errors=True)
+        raise
+
+
+def run_batch(in_path: str, out_path: str, default_model: str, workers: int = 4, rate_limits: dict = None,
+              retries: int = 4, system_prompt: str = None, mock_response: str = None, save_chats: bool = False,
+              api_base: str = None):
+
+    jobs = load_jobs(in_path, default_model, system_prompt)
+    done = completed_ids(out_path)
+    pending = [job for job in jobs if job["id"] not in done]
+    if len(pending) < len(jobs):
+        sys.stderr.write(f"resuming: {len(jobs) - len(pending)} of {len(jobs)} already done\n")
+
+    # mock_response makes litellm answer locally without calling any provider
+    completion_kwargs = {"mock_response": mock_response} if mock_response is not None else {}
+    if api_base:
+        completion_kwargs["api_base"] = api_base
+
+    with open(out_path, "a") as out_file:
+        runner = BatchRunner(out_file, workers, rate_limits or {}, retries, completion_kwargs, save_chats)
+        asyncio.run(runner.run(pending))
+    return runner.failed == 0
@@ -0,0 +1,245 @@
+#################################################
+## file         : cache.py
+## description  : opt-in on-disk cache of model
+##                responses, keyed on the model and
+##                the whole conversation sent, and
+##                the cache of rendered markdown
+##
+#################################################
+
+import os
+import re
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from gpt_repl.config import get_data_dir
+from gpt_repl.backend import make_chunk, response_from, usage_dict, StreamAccumulator, close_stream
+
+# cached replies are replayed as a stream of word-sized chunks so the streaming render path
+# treats them like any other reply
+_replay_chunk = re.compile(r'\s*\S+\s*|\s+')
+
+class ResponseCache:
+    """
+    one json file per response in ~/.gpt-repl/cache, named by the hash of (model, messages, params).
+    a file's mtime is its last use: hits touch it, and eviction drops the least recently used
+    files once the cache is over `max_bytes`, plus anything unused for `max_age` seconds
+    """
+
+    def __init__(self, max_bytes: int, max_age: float):
+        self.dir = os.path.join(get_data_dir(), "cache")
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.bypass_next = False
+
+    def key(self, model: str, messages: list, params: dict):
+        params = {name: value for name, value in params.items() if name != "stream"}
+        data = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def path(self, key: str):
+        return os.path.join(self.dir, key + ".json")
+
+    def get(self, key: str):
+        # aged by last use like evict(), checked before the read touches the file
+        path = self.path(key)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.max_age:
+                return None
+            with open(path, "r") as f:
+                record = json.load(f)
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            return None
+        return record
+
+    def put(self, key: str, model: str, content: str, finish_reason=None, usage=None):
+        record = {"model": model, "content": content, "finish_reason": finish_reason,
+                  "usage": usage_dict(usage), "created": time.time()}
+        tmp = self.path(key) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp, self.path(key))
+        self.evict()
+
+    def evict(self):
+        evict(self.dir, ".json", self.max_bytes, self.max_age)
+
+    def summary(self):
+        entries, total = dir_usage(self.dir, ".json")
+        return (f"\x1b[1mresponse cache\x1b[0m\n  {self.hits} hits, {self.misses} misses this session, "
+                f"{entries} entries, {total / 1e6:.1f}MB on disk\n")
+
+    def lookup(self, model: str, messages: list, params: dict):
+        # returns (key, record or None), counting the hit/miss. a bypassed turn always misses,
+        # and its fresh answer replaces whatever was cached
+        key = self.key(model, messages, params)
+        record = None
+        if self.bypass_next:
+            self.bypass_next = False
+        else:
+            record = self.get(key)
+        if record:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return key, record
+
+    def wrap(self, completion):
+        # returns a completion function that goes through the cache
+
+        def cached_completion(model: str, messages: list, stream: bool = False, **kwargs):
+            key, record = self.lookup(model, messages, kwargs)
+            if record:
+                if stream:
+                    return replay(record)
+                return response_from(record)
+
+            response = completion(model=model, messages=messages, stream=stream, **kwargs)
+            if stream:
+                return RecordingStream(self, key, model, response)
+            choice = response.choices[0]
+            self.put(key, model, choice.message.content, getattr(choice, "finish_reason", None), getattr(response, "usage", None))
+            return response
+
+        return cached_completion
+
+
+
+class RecordingStream:
+    """
+    passes a stream's chunks through and stores the reply once it has been read to the end.
+    close() closes the stream under it (a generator's close wouldn't reach it, or not before
+    the first chunk), so ctrl-c still stops the request with the cache on
+    """
+
+    def __init__(self, cache: ResponseCache, key: str, model: str, stream):
+        self.cache = cache
+        self.key = key
+        self.model = model
+        self.stream = stream
+        self.chunks = iter(stream)
+        self.reply = StreamAccumulator()
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            if not self.done:
+                self.done = True
+                reply = self.reply
+                self.cache.put(self.key, self.model, reply.text(), reply.finish_reason, reply.usage)
+            raise
+        self.reply.add(chunk)
+        return chunk
+
+    def close(self):
+        self.done = True  # a cut-off reply isn't cached
+        close_stream(self.stream)
+
+
+def replay(record: dict):
+    chunks = [make_chunk(piece) for piece in _replay_chunk.findall(record["content"])]
+    final = make_chunk("", finish_reason=record.get("finish_reason"))
+    final.final = record
+    return iter(chunks + [final])
+
+
+class RenderCache:
+    """
+    rendered (ansi) output of markdown, keyed on the content and everything that changes how
+    it renders: renderer, terminal width and style. entries are kept in memory for the session
+    and the renders of whole chats are written to <chat dir>/render too, so reopening a chat
+    or switching renderers with -p just writes out bytes instead of highlighting and wrapping
+    everything again
+    """
+
+    def __init__(self, max_memory: int, max_disk: int):
+        self.memory = OrderedDict()  # key -> output, least recently used first
+        self.memory_bytes = 0
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+
+    def key(self, markdown_str: str, renderer: str, width: int, style: str):
+        digest = hashlib.sha256(markdown_str.encode()).hexdigest()
+        return hashlib.sha256(f"{digest}\0{renderer}\0{width}\0{style}".encode()).hexdigest()
+
+    def get(self, key: str, chat_dir=None):
+        output = self.memory.get(key)
+        if output is not None:
+            self.memory.move_to_end(key)
+            return output
+        if not chat_dir:
+            return None
+
+        path = os.path.join(chat_dir, "render", key + ".ansi")
+        try:
+            with open(path, "r") as f:
+                output = f.read()
+            os.utime(path)  # mark as recently used
+        except OSError:
+            return None
+        self.remember(key, output)
+        return output
+
+    def put(self, key: str, output: str, chat_dir=None):
+        self.remember(key, output)
+        if not chat_dir or len(output) > self.max_disk:
+            return
+
+        render_dir = os.path.join(chat_dir, "render")
+        try:
+            if not os.path.exists(render_dir):
+                os.makedirs(render_dir)
+            path = os.path.join(render_dir, key + ".ansi")
+            with open(path + ".tmp", "w") as f:
+                f.write(output)
+            os.replace(path + ".tmp", path)
+            evict(render_dir, ".ansi", self.max_disk)
+        except OSError:
+            pass  # the cache is only an optimization
+
+    def remember(self, key: str, output: str):
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        self.memory[key] = output
+        self.memory_bytes += len(output)
+        while self.memory_bytes > self.max_memory and len(self.memory) > 1:
+            _, dropped = self.memory.popitem(last=False)
+            self.memory_bytes -= len(dropped)
+
+
+def evict(directory: str, suffix: str, max_bytes: int, max_age: float = None):
+    # drops files not used for max_age seconds, then the least recently used ones until
+    # the rest fits in max_bytes. a file's mtime is its last use
+    now = time.time()
+    entries = []
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(suffix):
+            continue
+        stat = entry.stat()
+        if max_age is not None and now - stat.st_mtime > max_age:
+            os.unlink(entry.path)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.unlink(path)
+        total -= size
+
+
+def dir_usage(directory: str, suffix: str):
+    sizes = [entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith(suffix)]
+    return len(sizes), sum(sizes)
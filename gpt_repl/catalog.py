@@ -0,0 +1,255 @@
+#################################################
+## file         : catalog.py
+## description  : sqlite index of saved chats, so
+##                startup and the chat selector
+##                don't have to scan ~/.gpt-repl/chats
+##
+#################################################
+
+import os
+import json
+import time
+import sqlite3
+from datetime import datetime
+from gpt_repl.config import get_data_dir, get_chats_dir
+
+_db = None
+_fts = False  # whether this sqlite build has fts5, checked on open
+
+schema = """
+CREATE TABLE IF NOT EXISTS chats (
+    id            TEXT PRIMARY KEY,  -- chat directory name, '<yymmdd_HHMMSS>_<model_dir>'
+    title         TEXT,
+    model         TEXT,
+    created       REAL,
+    updated       REAL,
+    message_count INTEGER,
+    byte_size     INTEGER
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS fts_progress (
+    chat_id TEXT PRIMARY KEY,
+    indexed INTEGER  -- number of the chat's messages that are in messages_fts
+);
+"""
+
+fts_schema = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content,
+    chat_id UNINDEXED,
+    role    UNINDEXED,
+    seq     UNINDEXED
+);
+"""
+
+def open_catalog():
+    global _db, _fts
+    if _db is None:
+        # the chat writer thread saves through this connection too. the repl flushes the
+        # writer before it reads the catalog again, so they never use it at the same time
+        _db = sqlite3.connect(os.path.join(get_data_dir(), 'catalog.db'), check_same_thread=False)
+        _db.executescript(schema)
+        try:
+            _db.executescript(fts_schema)
+            _fts = True
+        except sqlite3.OperationalError:
+            _fts = False  # sqlite built without fts5, search is unavailable
+    return _db
+
+
+def sync_catalog():
+    # the chats dir mtime changes whenever a chat is added or removed, so one stat() tells
+    # us whether the catalog is still in step with the directory (or if this is its first run)
+    db = open_catalog()
+    chats = get_chats_dir()
+    mtime = str(os.stat(chats).st_mtime_ns)
+
+    row = db.execute("SELECT value FROM meta WHERE key = 'chats_mtime'").fetchone()
+    if row and row[0] == mtime:
+        return
+
+    on_disk = set(os.listdir(chats))
+    in_catalog = {chat_id for (chat_id,) in db.execute("SELECT id FROM chats")}
+
+    with db:
+        for chat_id in in_catalog - on_disk:
+            db.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+            unindex_chat(db, chat_id)
+        for chat_id in on_disk - in_catalog:
+            chat_dir = os.path.join(chats, chat_id)
+            if os.path.isdir(chat_dir):
+                db.execute("INSERT INTO chats VALUES (?, ?, ?, ?, ?, ?, ?)", scan_chat(db, chat_dir))
+        set_chats_mtime(db, mtime)
+
+
+def scan_chat(db, chat_dir):
+    # build a catalog row for a chat dir the catalog hasn't seen (older chats, other machines),
+    # indexing its messages for search while they're loaded
+    from gpt_repl.chat import load_chat
+
+    chat_id = os.path.basename(chat_dir)
+
+    title_file = os.path.join(chat_dir, 'title.txt')
+    if os.path.exists(title_file):
+        with open(title_file, 'r') as file:
+            title = file.read().strip()
+    else:
+        title = chat_id
+
+    try:
+        messages = load_chat(chat_dir)
+    except (OSError, ValueError):
+        messages = []
+    message_count = len(messages)
+    index_chat(db, chat_dir, messages)
+
+    created = chat_created(chat_id)
+    updated = os.stat(chat_dir).st_mtime
+    return (chat_id, title, chat_model(chat_id), created, updated, message_count, dir_size(chat_dir))
+
+
+def chat_created(chat_id: str):
+    try:
+        return datetime.strptime(chat_id[:13], "%y%m%d_%H%M%S").timestamp()
+    except ValueError:
+        return 0.0
+
+
+def chat_model(chat_id: str):
+    # inverse of mkdir_new_chat()'s model.replace('/', '_'); providers never contain '_'
+    return chat_id[14:].replace('_', '/', 1)
+
+
+def dir_size(chat_dir):
+    return sum(entry.stat().st_size for entry in os.scandir(chat_dir) if entry.is_file())
+
+
+def set_chats_mtime(db, mtime: str = None):
+    if mtime is None:
+        mtime = str(os.stat(get_chats_dir()).st_mtime_ns)
+    db.execute("INSERT OR REPLACE INTO meta VALUES ('chats_mtime', ?)", (mtime,))
+
+
+def catalog_add(chat_dir, title: str, model: str):
+    sync_catalog()  # pick up any drift first, or marking the new mtime below would hide it
+    db = open_catalog()
+    now = time.time()
+    with db:
+        db.execute("INSERT OR REPLACE INTO chats VALUES (?, ?, ?, ?, ?, 0, ?)",
+                   (os.path.basename(chat_dir), title, model, now, now, dir_size(chat_dir)))
+        set_chats_mtime(db)
+
+
+def catalog_update(chat_dir, message_count: int):
+    db = open_catalog()
+    with db:
+        db.execute("UPDATE chats SET updated = ?, message_count = ?, byte_size = ? WHERE id = ?",
+                   (time.time(), message_count, dir_size(chat_dir), os.path.basename(chat_dir)))
+
+
+def catalog_count():
+    return open_catalog().execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+
+
+def catalog_page(offset: int, limit: int):
+    # newest first, same order as the timestamped directory names
+    rows = open_catalog().execute("SELECT id, title FROM chats ORDER BY id DESC LIMIT ? OFFSET ?", (limit, offset))
+    return [(os.path.join(get_chats_dir(), chat_id), title) for chat_id, title in rows]
+
+
+### full-text search #########################
+
+def index_messages(chat_dir, messages, changed_from: int = None):
+    db = open_catalog()
+    with db:
+        index_chat(db, chat_dir, messages, changed_from)
+
+
+def index_chat(db, chat_dir, messages, changed_from: int = None):
+    # messages are mostly appended, so just index the ones past what's already indexed.
+    # `changed_from` is the first message that's different from before (e.g. after a -retry)
+    if not _fts:
+        return
+    chat_id = os.path.basename(chat_dir)
+    row = db.execute("SELECT indexed FROM fts_progress WHERE chat_id = ?", (chat_id,)).fetchone()
+    indexed = row[0] if row else 0
+
+    if indexed > len(messages):
+        # history was rewritten, start over
+        unindex_chat(db, chat_id)
+        indexed = 0
+    elif changed_from is not None and changed_from < indexed:
+        db.execute("DELETE FROM messages_fts WHERE chat_id = ? AND seq >= ?", (chat_id, changed_from))
+        indexed = changed_from
+
+    db.executemany("INSERT INTO messages_fts (content, chat_id, role, seq) VALUES (?, ?, ?, ?)",
+                   [(message_text(message), chat_id, message.get("role"), seq)
+                    for seq, message in enumerate(messages[indexed:], indexed)])
+    db.execute("INSERT OR REPLACE INTO fts_progress VALUES (?, ?)", (chat_id, len(messages)))
+
+
+def unindex_chat(db, chat_id: str):
+    if _fts:
+        db.execute("DELETE FROM messages_fts WHERE chat_id = ?", (chat_id,))
+        db.execute("DELETE FROM fts_progress WHERE chat_id = ?", (chat_id,))
+
+
+def message_text(message):
+    content = message.get("content") or ""
+    if isinstance(content, str):
+        return content
+    return json.dumps(content)  # multi-part content
+
+
+def index_pending():
+    # chats catalogued before search existed have no fts_progress row yet
+    from gpt_repl.chat import load_chat
+
+    db = open_catalog()
+    pending = [chat_id for (chat_id,) in db.execute(
+        "SELECT id FROM chats WHERE id NOT IN (SELECT chat_id FROM fts_progress)")]
+    with db:
+        for chat_id in pending:
+            chat_dir = os.path.join(get_chats_dir(), chat_id)
+            try:
+                index_chat(db, chat_dir, load_chat(chat_dir))
+            except (OSError, ValueError):
+                index_chat(db, chat_dir, [])
+
+
+def fts_query(query: str):
+    # quote every term so punctuation in the query isn't read as fts5 syntax
+    return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+
+def search_available():
+    open_catalog()
+    return _fts
+
+
+def search_messages(query: str, limit: int = 10):
+    db = open_catalog()
+    rows = db.execute("""
+        SELECT f.chat_id, c.title, f.role, snippet(messages_fts, 0, '\x1b[1;93m', '\x1b[0m', '…', 12)
+        FROM messages_fts f LEFT JOIN chats c ON c.id = f.chat_id
+        WHERE messages_fts MATCH ? ORDER BY f.rank LIMIT ?""", (fts_query(query), limit))
+    return [(os.path.join(get_chats_dir(), chat_id), title or chat_id, role, snippet)
+            for chat_id, title, role, snippet in rows]
+
+
+def search_count(query: str):
+    return open_catalog().execute(
+        "SELECT COUNT(DISTINCT chat_id) FROM messages_fts WHERE messages_fts MATCH ?", (fts_query(query),)).fetchone()[0]
+
+
+def search_page(query: str, offset: int, limit: int):
+    # chats ranked by their best matching message, for the chat selector
+    rows = open_catalog().execute("""
+        SELECT m.chat_id, c.title FROM (
+            SELECT chat_id, MIN(rank) AS best FROM messages_fts WHERE messages_fts MATCH ? GROUP BY chat_id
+        ) m LEFT JOIN chats c ON c.id = m.chat_id
+        ORDER BY m.best LIMIT ? OFFSET ?""", (fts_query(query), limit, offset))
+    return [(os.path.join(get_chats_dir(), chat_id), title or chat_id) for chat_id, title in rows]
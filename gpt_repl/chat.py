@@ -7,34 +7,43 @@
 import sys
 import os
 import json
-from datetime import datetime
-from gpt_repl.render import render, print_rule, clear_lines, count_lines 
+from datetime import datetime, timedelta
+from gpt_repl.render import render, print_rule, color_codes, provider_color_table
+from gpt_repl.screen import Screen
 from gpt_repl.input import getch
+from gpt_repl.config import get_chats_dir
+from gpt_repl.catalog import sync_catalog, catalog_add, catalog_update, catalog_count, catalog_page, chat_model, message_text
+from gpt_repl.catalog import index_messages, index_pending, search_available, search_messages, search_count, search_page
+from gpt_repl.store import has_chain, load_chain, save_chain, fork_chain, collect_garbage, store_counts, store_path
+
+# a chat dir holds a HEAD naming its last message in the store (see store.py), chat.md is made
+# from the messages when the chat is printed. chats from before the store have messages.json
+# (and a messages.jsonl journal), they're moved into the store the next time they're saved,
+# or all at once with `gpt --migrate`
+legacy_files = ("messages.json", "messages.jsonl", "chat.md", "chat.idx")
 
 def sel_chat():
-    chat_dirs = list_of_chat_paths()
+    sync_catalog()
     page_size = 5
     current_page = 0
-    max_page = (len(chat_dirs) + page_size - 1) // page_size
-    num_lines = 0
+    query = ""
+    max_page = (catalog_count() + page_size - 1) // page_size
+    screen = Screen()
 
     while 1:
         start = current_page * page_size
-        end = start + page_size
-        displayed_chats = chat_dirs[start:end]
+        if query:
+            displayed_chats = search_page(query, start, page_size)
+        else:
+            displayed_chats = catalog_page(start, page_size)
 
-        clear_lines(num_lines)
-        output_str = f"\nSelect chat: (0-{page_size}, default: 0)\n\n"
+        if query:
+            output_str = f"\nSelect chat matching \x1b[1;93m{query}\x1b[0m: (0-{page_size}, default: 0, s to change search)\n\n"
+        else:
+            output_str = f"\nSelect chat: (0-{page_size}, default: 0, s to search)\n\n"
         output_str += "\x1b[96m\x1b[1m0. New Chat\x1b[0m\n"
 
-        for i, chat in enumerate(displayed_chats, 1):
-            title_file = os.path.join(chat, 'title.txt')
-            if os.path.exists(title_file):
-                with open(title_file, 'r') as file:
-                    chat_title = file.read().strip()
-            else:
-               chat_title = os.path.basename(chat)
-
+        for i, (chat, chat_title) in enumerate(displayed_chats, 1):
             output_str += f"{i}. {chat_title}\n"
 
         output_str += "\n"
@@ -47,15 +56,12 @@ def sel_chat():
             prompt_str = f"(Showing {start + 1}-{start + len(displayed_chats)}: p for previous): "
 
         output_str += prompt_str
-        num_lines = count_lines(output_str) - 1
-
-        sys.stdout.write(output_str)
-        sys.stdout.flush
+        screen.update(output_str)  # only the lines that changed since the last page are redrawn
 
         choice = getch().lower()
 
         if choice == '\n' or choice == '\r':
-            clear_lines(num_lines)
+            screen.clear()
             return None
         elif choice == 'q' or choice == '\x03': # ctrl-c
             sys.stdout.write("\r\x1b[K")
@@ -66,36 +72,58 @@ def sel_chat():
             current_page += 1
         elif choice == 'p' and current_page > 0:
             current_page -= 1
+        elif choice == 's' and search_available():
+            # filter the list down to chats with messages matching a full-text query
+            screen.update(output_str[:-len(prompt_str)] + "\x1b[96msearch:\x1b[0m ")
+            try:
+                typed = input()
+            except (KeyboardInterrupt, EOFError):
+                typed = ""
+            screen.echoed(typed + "\n")
+            query = typed.strip()
+            current_page = 0
+            if query:
+                index_pending()
+                max_page = (search_count(query) + page_size - 1) // page_size
+            else:
+                max_page = (catalog_count() + page_size - 1) // page_size
         elif choice.isdigit() and int(choice) > 0 and int(choice) <= len(displayed_chats):
-            clear_lines(num_lines)
-            return chat_dirs[start + int(choice) - 1]
+            screen.clear()
+            return displayed_chats[int(choice) - 1][0]
         elif choice == '0':
-            clear_lines(num_lines)
+            screen.clear()
             return None
 
 
 def mkdir_new_chat(model: str, user_input: str):
+    chat_dir = new_chat_dir(model)
+    init_chat(chat_dir, model, user_input)
+    return chat_dir
+
+
+def new_chat_dir(model: str):
 
     # replace `/` with `_` so model can be used as a dir name
     model_dir = model.replace('/', '_')
-    model_name = model.split('/')[1]
 
-    # create chats directory if it doesn't exist
-    chats = os.path.join(os.path.expanduser('~'), '.gpt-repl', 'chats')
-    if not os.path.exists(chats):
-        os.makedirs(chats)
+    chats = get_chats_dir()
+
+    # create new chat directory with timestamp. a chat made in the same second as another
+    # (a fork, a batch) takes the next free second instead, ids stay one per chat
+    now = datetime.now()
+    while 1:
+        chat_dir = os.path.join(chats, f"{now.strftime('%y%m%d_%H%M%S')}_{model_dir}")
+        try:
+            os.makedirs(chat_dir)
+            return chat_dir
+        except FileExistsError:
+            now += timedelta(seconds=1)
 
-    # create new chat directory with timestamp
-    timestamp = datetime.now().strftime("%y%m%d_%H%M%S")
-    chat_dir = os.path.join(chats, f"{timestamp}_{model_dir}")
-    os.makedirs(chat_dir)
 
-    # initialize empty messages.json file
-    with open(os.path.join(chat_dir, 'messages.json'), "w") as f:
-        json.dump([],f)
+def init_chat(chat_dir, model: str, user_input: str):
+    # the title and catalog entry of a chat made by new_chat_dir(), its messages come with save_chat()
 
-    # initialize empty chat.md file
-    open(os.path.join(chat_dir, 'chat.md'), "w").close()
+    model_name = model.split('/')[-1]  # "gpt-4o-mini" as well as "openai/gpt-4o-mini"
 
     if len(user_input) > 28:
         trunc = user_input[:28]
@@ -118,6 +146,8 @@ def mkdir_new_chat(model: str, user_input: str):
     with open(os.path.join(chat_dir, "title.txt"), "w") as f:
         f.write(chat_title)
 
+    catalog_add(chat_dir, chat_title, model)
+
     return chat_dir
 
 
@@ -141,37 +171,237 @@ def remove_system_message(messages):
     return messages[:]
 
 
-def save_chat(chat_dir, messages, user_input: str, assistant_response: str):
-
-    with open(os.path.join(chat_dir, "messages.json"), "w") as f:
-        json.dump(messages, f, indent=2)
+def save_chat(chat_dir, messages, model: str):
+    # messages is the whole conversation, only what isn't in the store yet gets written.
+    # the assistant messages among those are credited to `model`
+    if not has_chain(chat_dir):
+        migrate_chat(chat_dir)
+    changed_from = save_chain(chat_dir, messages, model)
 
-    with open(os.path.join(chat_dir, "chat.md"), "a") as f:
-        f.write(f": {user_input}\n\n")
-        f.write(f"{assistant_response}\n\n")
-
-
-def list_of_chat_paths():
-   # create chats directory if it doesn't exist
-    chats = os.path.join(os.path.expanduser('~'), '.gpt-repl', 'chats')
-    if not os.path.exists(chats):
-        os.makedirs(chats)
-
-    chat_paths = sorted([os.path.join(chats, file) for file in os.listdir(chats)], reverse=True)
-    return chat_paths
+    catalog_update(chat_dir, len(messages))
+    index_messages(chat_dir, messages, changed_from)
 
 
 def load_chat(chat_dir):
-    with open(os.path.join(chat_dir, "messages.json"), "r") as f:
+    if has_chain(chat_dir):
+        return [message for _, message, _ in load_chain(chat_dir)]
+    return load_legacy_chat(chat_dir)
+
+
+def chat_entries(chat_dir):
+    # [(node, message, model), ...], model being who wrote each assistant message. for a chat in
+    # the store it's the cached chain itself, the same list until the chat's HEAD moves
+    if has_chain(chat_dir):
+        return load_chain(chat_dir)
+    model = chat_model(os.path.basename(chat_dir))
+    return [(None, message, model if message.get("role") == "assistant" else None) for message in load_legacy_chat(chat_dir)]
+
+
+def fork_chat(chat_dir, turn: int):
+    """
+    a new chat with the first `turn` turns of `chat_dir` (all of them when None), sharing their
+    messages in the store. returns the new chat dir, or None if there's no such turn
+    """
+    if not has_chain(chat_dir):
+        migrate_chat(chat_dir)
+    starts = turn_starts(load_chat(chat_dir))
+    if turn is None:
+        turn = len(starts)
+    if not 0 < turn <= len(starts):
+        return None
+    num_messages = starts[turn] if turn < len(starts) else len(load_chat(chat_dir))
+
+    chat_id = os.path.basename(chat_dir)
+    model = chat_model(chat_id)
+    new_dir = new_chat_dir(model)
+    fork_chain(chat_dir, new_dir, num_messages)
+    for name in ("system.txt", "tokens.json", "summary.json"):
+        # the system prompt and token counts hold for the shared turns too
+        if os.path.exists(os.path.join(chat_dir, name)):
+            with open(os.path.join(chat_dir, name), "rb") as f, open(os.path.join(new_dir, name), "wb") as g:
+                g.write(f.read())
+
+    title_file = os.path.join(chat_dir, "title.txt")
+    title = chat_id
+    if os.path.exists(title_file):
+        with open(title_file, "r") as f:
+            title = f.read().strip()
+    title += f" \x1b[90m(fork@{turn})\x1b[0m"
+    with open(os.path.join(new_dir, "title.txt"), "w") as f:
+        f.write(title)
+
+    messages = load_chat(new_dir)
+    catalog_add(new_dir, title, model)
+    catalog_update(new_dir, len(messages))
+    index_messages(new_dir, messages)
+    return new_dir
+
+
+### chats from before the store ############
+
+def load_legacy_chat(chat_dir):
+    # messages.json is a snapshot, messages.jsonl the journal of messages saved after it.
+    # chats from before the journal only have messages.json
+    snapshot = os.path.join(chat_dir, "messages.json")
+    if not os.path.exists(snapshot):
+        return []
+    with open(snapshot, "r") as f:
         messages = json.load(f)
 
+    journal = os.path.join(chat_dir, "messages.jsonl")
+    if os.path.exists(journal):
+        with open(journal, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # torn write from a crash, nothing after it is usable
+                if record["i"] == len(messages):
+                    messages.append(record["message"])
     return messages
 
 
-def print_chat(chat_dir, renderer: str, color: str):
+def migrate_chat(chat_dir):
+    # moves a chat's messages into the store and drops its old files. returns False if there
+    # was nothing to move (a new chat, or one already in the store)
+    if has_chain(chat_dir) or not os.path.exists(os.path.join(chat_dir, "messages.json")):
+        return False
+    messages = load_legacy_chat(chat_dir)
+    if messages:
+        save_chain(chat_dir, messages, chat_model(os.path.basename(chat_dir)))
+    for name in legacy_files:
+        try:
+            os.remove(os.path.join(chat_dir, name))
+        except FileNotFoundError:
+            pass
+    return True
+
+
+def migrate_chats():
+    # `gpt --migrate`: every chat into the store, with the disk used before and after
+    chats = get_chats_dir()
+    before = disk_usage(chats)
+    migrated = messages = 0
+    for entry in sorted(os.scandir(chats), key=lambda entry: entry.name):
+        if entry.is_dir() and not has_chain(entry.path):
+            count = len(load_legacy_chat(entry.path))
+            if migrate_chat(entry.path):
+                migrated += 1
+                messages += count
+    dropped_nodes, dropped_messages = collect_garbage(chats)
+    after = disk_usage(chats)
+    nodes, stored = store_counts()
+    in_chats = sum(len(load_chat(entry.path)) for entry in os.scandir(chats) if entry.is_dir())
+
+    mb = lambda size: f"{size / 1e6:.2f} MB"
+    print(f"moved {migrated} chat{'s' if migrated != 1 else ''} ({messages} messages) into the store")
+    print(f"{in_chats} messages in chats, {nodes} after sharing common starts, {stored} distinct ones stored"
+          + (f" (dropped {dropped_nodes} no chat used)" if dropped_nodes else ""))
+    print(f"{'':<10}{'files':>8}{'size':>12}{'on disk':>12}")
+    for label, (files, size, allocated) in (("before", before), ("after", after)):
+        print(f"{label:<10}{files:>8}{mb(size):>12}{mb(allocated):>12}")
+
+
+def disk_usage(chats_dir):
+    # (files, bytes, bytes allocated in blocks) of the chats and the store
+    files = size = allocated = 0
+    paths = [os.path.join(root, name) for root, _, names in os.walk(chats_dir) for name in names]
+    paths += [store_path() + suffix for suffix in ("", "-wal", "-shm")]
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files += 1
+        size += stat.st_size
+        allocated += getattr(stat, "st_blocks", 0) * 512 or stat.st_size
+    return files, size, allocated
+
+
+def print_search(query: str):
+    if not search_available():
+        print("search is unavailable: this sqlite build has no fts5\n")
+        return
+
+    sync_catalog()
+    index_pending()
+    hits = search_messages(query)
+    if not hits:
+        print(f"no messages matching '{query}'\n")
+        return
+
+    print()
+    for i, (chat_dir, title, role, snippet) in enumerate(hits, 1):
+        print(f"{i}. {title} \x1b[90m{os.path.basename(chat_dir)} ({role})\x1b[0m")
+        print(f"   {' '.join(snippet.split())}")
+    print()
+
+
+### chat.md ###############################
+
+# a chat's transcript is made from its messages when it's printed, one turn per user message.
+# only the turns on screen are made, so opening a chat or paging back with -b costs the same
+# however long it is
+
+_turn_starts = {}  # chat_dir -> (the chain list they're for, turn starts)
+
+def turn_starts(messages):
+    # index of the message each turn starts at
+    return [i for i, message in enumerate(messages) if message.get("role") == "user"]
+
+
+def chat_turns(chat_dir, start: int = 0, end: int = None):
+    # the chat.md text of turns [start, end), and how many turns the chat has
+    entries = chat_entries(chat_dir)
+    cached = _turn_starts.get(chat_dir)
+    if cached and cached[0] is entries:
+        starts = cached[1]
+    else:
+        starts = turn_starts([message for _, message, _ in entries])
+        _turn_starts[chat_dir] = (entries, starts)
+
+    end = len(starts) if end is None else min(end, len(starts))
+    turns = []
+    for turn in range(start, end):
+        stop = starts[turn + 1] if turn + 1 < len(starts) else len(entries)
+        text = ""
+        for _, message, model in entries[starts[turn]:stop]:
+            role = message.get("role")
+            if role == "user":
+                text += f": {message_text(message)}\n\n"
+            elif role == "assistant":
+                model = model or "assistant"
+                color = color_codes[provider_color_table.get(model.split('/')[0], "green")]
+                text += f"\x1b[1m{color}{model}:\x1b[0m {message_text(message)}\n\n"
+        turns.append(text)
+    return turns, len(starts)
+
+
+def print_chat(chat_dir, renderer: str, color: str, open_turns: int = 0):
+    """
+    prints the last `open_turns` turns of the chat (all of them when 0) and returns the index
+    of the first turn printed, to page back from with print_earlier()
+    """
     print(f"\n\x1b[1m{os.path.basename(chat_dir)}:\x1b[0m \x1b[96m'q' to quit '-h' for help\x1b[0m")
     print_rule(color)
 
-    with open(os.path.join(chat_dir, "chat.md"), "r") as f:
-        render(f.read().rstrip(), color, renderer) # .rstrip() removes trailing newlines
-
+    num_turns = chat_turns(chat_dir, 0, 0)[1]
+    start = max(0, num_turns - open_turns) if open_turns > 0 else 0
+    if start > 0:
+        print(f"\x1b[90m{start} earlier turn{'s' if start > 1 else ''}, '-b' to show {'them' if start > 1 else 'it'}\x1b[0m")
+    turns, _ = chat_turns(chat_dir, start)
+    render("".join(turns).rstrip(), color, renderer, chat_dir) # .rstrip() removes trailing newlines
+    return start
+
+
+def print_earlier(chat_dir, shown_from: int, num_turns: int, renderer: str, color: str):
+    # prints the `num_turns` turns before `shown_from` and returns the new first shown turn
+    if shown_from <= 0:
+        print("\x1b[90mthat's the start of the chat\x1b[0m\n")
+        return 0
+
+    start = max(0, shown_from - num_turns)
+    turns, total = chat_turns(chat_dir, start, shown_from)
+    print(f"\n\x1b[90mturns {start + 1}-{shown_from} of {total}" + (", '-b' for more" if start else "") + "\x1b[0m")
+    render("".join(turns).rstrip(), color, renderer, chat_dir)
+    return start
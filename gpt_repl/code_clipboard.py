@@ -5,9 +5,9 @@
 #################################################
 
 import re
-import pyperclip
 
 def copy_code_block(markdown_str: str, code_block_index: int):
+    import pyperclip  # only needed once someone copies something
 
     code_blocks = re.findall(r'^\s*```.*?\n(.*?)\n\s*```\s*$', markdown_str, re.DOTALL | re.MULTILINE)
 
@@ -9,12 +9,29 @@ import sys
 import subprocess
 from configparser import ConfigParser
 
-def get_config_path(filename: str):
+def get_data_dir():
+
+    data_dir = os.path.join(os.path.expanduser('~'), '.gpt-repl')
+
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+
+    return data_dir
+
+
+def get_chats_dir():
+
+    chats = os.path.join(get_data_dir(), 'chats')
 
-    config_dir = os.path.join(os.path.expanduser('~'), '.gpt-repl')
+    if not os.path.exists(chats):
+        os.makedirs(chats)
 
-    if not os.path.exists(config_dir):
-        os.makedirs(config_dir)
+    return chats
+
+
+def get_config_path(filename: str):
+
+    config_dir = get_data_dir()
 
     config_path = os.path.join(config_dir, filename)
 
@@ -51,9 +68,27 @@ conf_str = """
 # settings:
 #   system-prompt
 #   model
+#   api_base
 #   renderer
+#   rich_fps
 #   stream
 #   always_new_chat
+#   open_turns
+#   context_budget
+#   context_strategy
+#   context_pinned_turns
+#   daemon
+#   daemon_idle_timeout
+#   fanout_models
+#   batch_workers
+#   batch_rate_limits
+#   batch_retries
+#   cache
+#   cache_max_mb
+#   cache_max_age_days
+#   render_cache
+#   render_cache_mb
+#   background_writes
 
 # INITIAL SYSTEM PROMPT (only applies to new chats):
 system-prompt = You are a helpful assistant.
@@ -64,15 +99,76 @@ system-prompt = You are a helpful assistant.
 model = openai/o1-mini
 #model = anthropic/claude-3-5-haiku-latest
 
+# SEND REQUESTS TO THIS OPENAI-COMPATIBLE SERVER INSTEAD OF THE PROVIDER'S OWN (empty = the provider's):
+# (e.g. a local server, or benchmarks/mock_server.py with model = openai/mock)
+api_base =
+
 # DEFAULT TEXT RENDERER:
 #renderer = raw
 renderer = lite
 #renderer = rich
 
+# HOW MANY TIMES A SECOND THE rich RENDERER REDRAWS A STREAMING RESPONSE:
+rich_fps = 8
+
 # STREAM MODEL RESPONSE? (true/false)
 stream = false
 
 # ALWAYS CREATE A NEW CHAT WITHOUT ASKING TO SELECT FROM PREV CHATS? (true/false):
 always_new_chat = false
 
+# NUMBER OF LAST TURNS SHOWN WHEN OPENING A CHAT, `-b` SHOWS EARLIER ONES (0 = the whole chat):
+open_turns = 10
+
+# CONTEXT WINDOW: MAX TOKENS OF CHAT HISTORY SENT PER REQUEST (0 = send the whole chat):
+context_budget = 0
+
+# WHICH HISTORY TO SEND WHEN A CHAT GOES OVER THE BUDGET (the full chat is always saved):
+#   sliding = newest turns only
+#   pinned  = system prompt and first turns, then newest turns
+#   summary = like pinned, plus a rolling summary of the turns left out
+context_strategy = pinned
+
+# NUMBER OF FIRST TURNS KEPT BY pinned/summary:
+context_pinned_turns = 1
+
+# KEEP LITELLM WARM IN A BACKGROUND DAEMON SHARED BY ALL gpt SESSIONS? (true/false)
+# (stop it with `gpt --daemon-stop`, e.g. after changing API keys)
+daemon = false
+
+# SECONDS WITHOUT REQUESTS BEFORE THE DAEMON EXITS:
+daemon_idle_timeout = 1800
+
+# FAN-OUT: SEND EVERY PROMPT TO ALL OF THESE MODELS AT ONCE AND PICK AN ANSWER (comma separated, empty = off)
+#fanout_models = openai/gpt-4o-mini, anthropic/claude-3-5-haiku-latest
+fanout_models =
+
+# BATCH MODE (gpt --batch in.jsonl --out out.jsonl):
+# concurrent requests
+batch_workers = 4
+# max requests per second, per provider (unlisted providers are not limited)
+batch_rate_limits = openai: 5, anthropic: 2
+# retries of rate limit / connection / server errors, with exponential backoff
+batch_retries = 4
+
+# CACHE RESPONSES ON DISK AND ANSWER REPEATED REQUESTS (same model, same messages) FROM IT? (true/false)
+# (`-nocache` asks the model again for the next prompt and replaces the cached answer)
+cache = false
+
+# MAX SIZE OF THE CACHE IN MB (least recently used answers are dropped first):
+cache_max_mb = 50
+
+# DAYS AN UNUSED ANSWER STAYS IN THE CACHE:
+cache_max_age_days = 30
+
+# KEEP RENDERED CHATS/RESPONSES SO REOPENING A CHAT OR `-p` DOESN'T RENDER THEM AGAIN? (true/false)
+render_cache = true
+
+# MAX SIZE IN MB OF THE RENDER CACHE, IN MEMORY AND ON DISK PER CHAT:
+render_cache_mb = 20
+
+# SAVE CHATS ON A BACKGROUND THREAD, SO A SLOW DISK DOESN'T HOLD UP REPLIES AND THE NEXT PROMPT? (true/false)
+# (everything is written before gpt exits, `-stats` shows how long writes take)
+background_writes = true
+
 """
@@ -0,0 +1,151 @@
+#################################################
+## file         : context.py
+## description  : picks which part of a chat's
+##                history is sent to the API, under
+##                a token budget
+##
+#################################################
+
+import os
+import sys
+import json
+import hashlib
+
+summary_prompt = ("Summarize the following earlier part of a conversation as briefly as possible. "
+                  "Keep facts, decisions, names and code details that are needed to continue it.")
+
+class ContextWindow:
+    """
+    sits between main()'s `messages` (the full history, which is saved untouched) and the
+    completion call. select() returns the messages to send:
+
+      sliding : the newest whole turns that fit in the budget
+      pinned  : system messages and the first `pinned_turns` turns, then the newest turns
+      summary : like pinned, plus a rolling summary of the turns that were left out
+
+    token counts are computed once per message and cached in the chat's tokens.json
+    """
+
+    def __init__(self, model: str, budget: int, strategy: str = "pinned", pinned_turns: int = 1, chat_dir=None):
+        self.model = model
+        self.budget = budget
+        self.strategy = strategy
+        self.pinned_turns = pinned_turns
+        self.chat_dir = None
+        self.counts = {}
+        self.summary = {"count": 0, "text": ""}  # rolling summary of the first `count` evicted messages
+        self.dirty = False
+        if chat_dir:
+            self.attach(chat_dir)
+
+    def attach(self, chat_dir):
+        # new chats only get a directory after their first reply
+        self.chat_dir = chat_dir
+        tokens = os.path.join(chat_dir, "tokens.json")
+        if os.path.exists(tokens):
+            with open(tokens, "r") as f:
+                self.counts = {**json.load(f), **self.counts}
+        summary = os.path.join(chat_dir, "summary.json")
+        if os.path.exists(summary):
+            with open(summary, "r") as f:
+                self.summary = json.load(f)
+        self.save()
+
+    def save(self):
+        if not self.chat_dir or not self.dirty:
+            return
+        with open(os.path.join(self.chat_dir, "tokens.json"), "w") as f:
+            json.dump(self.counts, f)
+        with open(os.path.join(self.chat_dir, "summary.json"), "w") as f:
+            json.dump(self.summary, f)
+        self.dirty = False
+
+    def count(self, message):
+        key = hashlib.sha1(json.dumps([self.model, message], sort_keys=True).encode()).hexdigest()[:16]
+        if key not in self.counts:
+            try:
+                # with the daemon, litellm is never imported here and the estimate is used
+                token_counter = sys.modules["litellm"].token_counter
+                self.counts[key] = token_counter(model=self.model, messages=[message])
+            except Exception:
+                self.counts[key] = len(json.dumps(message.get("content"))) // 4 + 4
+            self.dirty = True
+        return self.counts[key]
+
+    def select(self, messages, completion=None):
+        if self.budget <= 0:
+            return messages
+
+        counts = [self.count(message) for message in messages]
+        self.save()
+        if sum(counts) <= self.budget:
+            return messages
+
+        budget = self.budget
+        pinned_end = 0
+        if self.strategy in ("pinned", "summary"):
+            pinned_end = self.pinned_end(messages)
+            budget -= sum(counts[:pinned_end])
+        if self.strategy == "summary":
+            budget -= self.budget // 8  # room for the summary itself
+
+        # newest whole turns first. the last turn holds the new prompt, so it's always sent
+        turns = split_turns(messages, pinned_end)
+        kept_start = len(messages)
+        for start, end in reversed(turns):
+            cost = sum(counts[start:end])
+            if kept_start < len(messages) and cost > budget:
+                break
+            kept_start = start
+            budget -= cost
+
+        window = messages[:pinned_end]
+        if self.strategy == "summary" and kept_start > pinned_end and completion:
+            window = window + [self.summarize(messages[pinned_end:kept_start], completion)]
+        return window + messages[kept_start:]
+
+    def pinned_end(self, messages):
+        # index just past the leading system messages and the first `pinned_turns` turns
+        i = 0
+        while i < len(messages) and messages[i].get("role") == "system":
+            i += 1
+        turns = split_turns(messages, i)
+        if self.pinned_turns <= 0 or not turns:
+            return i
+        # never pin the last turn, it's the one being asked
+        pinned = turns[:min(self.pinned_turns, len(turns) - 1)]
+        return pinned[-1][1] if pinned else i
+
+    def summarize(self, evicted, completion):
+        # the evicted range only grows as the chat goes on, so fold just the newly evicted
+        # messages into the previous summary
+        covered = self.summary["count"]
+        if covered > len(evicted):
+            covered = 0
+            self.summary = {"count": 0, "text": ""}
+
+        if covered < len(evicted):
+            transcript = "\n\n".join(f"{m.get('role')}: {m.get('content')}" for m in evicted[covered:])
+            if self.summary["text"]:
+                transcript = f"summary so far: {self.summary['text']}\n\n{transcript}"
+            response = completion(model=self.model, max_tokens=self.budget // 8, messages=[
+                {"role": "system", "content": summary_prompt},
+                {"role": "user", "content": transcript}])
+            self.summary = {"count": len(evicted), "text": response.choices[0].message.content}
+            self.dirty = True
+            self.save()
+
+        return {"role": "system", "content": f"Summary of the earlier conversation: {self.summary['text']}"}
+
+
+def split_turns(messages, start: int):
+    # a turn is a user message plus everything up to the next user message
+    turns = []
+    turn_start = start
+    for i in range(start + 1, len(messages)):
+        if messages[i].get("role") == "user":
+            turns.append((turn_start, i))
+            turn_start = i
+    if turn_start < len(messages):
+        turns.append((turn_start, len(messages)))
+    return turns
@@ -0,0 +1,303 @@
+#################################################
+## file         : daemon.py
+## description  : optional long-lived process that
+##                keeps litellm imported and warm,
+##                served over a unix domain socket
+##
+#################################################
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import socketserver
+from types import SimpleNamespace
+from gpt_repl.config import get_data_dir
+from gpt_repl.backend import make_chunk, make_response, response_from, usage_dict, close_stream, count_usage, StreamAccumulator
+
+# protocol: the client sends one json line {"model", "messages", "stream", "kwargs"} (or
+# {"command": "stop"}), the daemon answers with json lines: {"delta": str} per streamed chunk,
+# then {"done": true, "content", "finish_reason", "usage"}, or {"error": str} if anything failed
+
+class DaemonUnavailable(Exception):
+    pass
+
+
+class DaemonError(Exception):
+    pass
+
+
+def socket_path():
+    return os.path.join(get_data_dir(), "daemon.sock")
+
+
+### server ##################################
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, backend: str, idle_timeout: float):
+        super().__init__(path, DaemonHandler)
+        os.chmod(path, 0o600)  # requests carry whole conversations, keep them to this user
+        self.backend = backend
+        self.idle_timeout = idle_timeout
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        self.active = 0
+        self.last_used = time.monotonic()
+        self.completion = None
+        self.count_usage = None
+
+    def warm_up(self):
+        # bind first and import after, so clients (and other spawn attempts) see the daemon right away
+        if self.backend == "stub":
+            self.completion = stub_completion
+            self.count_usage = stub_count_usage
+        else:
+            from litellm import completion
+            self.completion = completion
+            self.count_usage = count_usage
+        self.ready.set()
+
+    def watch_idle(self):
+        while 1:
+            time.sleep(min(5.0, self.idle_timeout))
+            with self.lock:
+                idle = self.active == 0 and time.monotonic() - self.last_used > self.idle_timeout
+            if idle:
+                self.shutdown()
+                return
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+
+    def send(self, record: dict):
+        self.wfile.write((json.dumps(record) + "\n").encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+        try:
+            request = json.loads(self.rfile.readline())
+            if request.get("command") == "stop":
+                self.send({"done": True})
+                threading.Thread(target=server.shutdown, daemon=True).start()
+                return
+            server.ready.wait()
+            self.complete(request)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client went away (e.g. ctrl-c), nothing left to answer
+        except Exception as e:
+            try:
+                self.send({"error": f"{type(e).__name__}: {e}"})
+            except OSError:
+                pass
+        finally:
+            with server.lock:
+                server.active -= 1
+                server.last_used = time.monotonic()
+
+    def complete(self, request: dict):
+        server = self.server
+        kwargs = request.get("kwargs", {})
+
+        if not request.get("stream"):
+            response = server.completion(model=request["model"], messages=request["messages"], **kwargs)
+            self.send(done_record(response))
+            return
+
+        reply = StreamAccumulator()
+        response = server.completion(model=request["model"], messages=request["messages"], stream=True, **kwargs)
+        try:
+            for chunk in response:
+                delta = reply.add(chunk)
+                if delta:
+                    self.send({"delta": delta})
+        finally:
+            close_stream(response)  # stops generating (and billing) when the client hung up
+        if not reply.usage:
+            reply.usage = server.count_usage(request["model"], request["messages"], reply.text())
+        self.send(done_record(reply.response()))
+
+
+def done_record(response):
+    choice = response.choices[0]
+    return {
+        "done": True,
+        "content": choice.message.content,
+        "finish_reason": getattr(choice, "finish_reason", None),
+        "usage": usage_dict(getattr(response, "usage", None)),
+    }
+
+
+def serve(backend: str = "litellm", idle_timeout: float = 1800):
+    path = socket_path()
+    if daemon_running():
+        return  # another daemon won the race
+
+    if os.path.exists(path):
+        os.unlink(path)  # stale socket from a daemon that didn't exit cleanly
+
+    try:
+        server = DaemonServer(path, backend, idle_timeout)
+    except OSError:
+        return
+    threading.Thread(target=server.warm_up, daemon=True).start()
+    threading.Thread(target=server.watch_idle, daemon=True).start()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+### stub backend ############################
+
+def stub_completion(model: str, messages: list, stream: bool = False, **kwargs):
+    # echoes the last message back, for trying the daemon without an api key
+    text = f"stub reply to: {messages[-1]['content']}"
+    if not stream:
+        return make_response(text, usage=stub_usage(messages, text))
+    return (make_chunk(word + " ") for word in text.split(" "))
+
+
+def stub_count_usage(model: str, messages: list, text: str):
+    return stub_usage(messages, text)
+
+
+def stub_usage(messages, text: str):
+    prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in messages)
+    completion_tokens = len(text) // 4
+    return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens)
+
+
+### client ##################################
+
+def daemon_running():
+    try:
+        connect().close()
+        return True
+    except DaemonUnavailable:
+        return False
+
+
+def connect():
+    if not hasattr(socket, "AF_UNIX"):
+        raise DaemonUnavailable("unix domain sockets are not supported here")
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path())
+    except OSError as e:
+        sock.close()
+        raise DaemonUnavailable(str(e))
+    return sock
+
+
+def spawn_daemon(idle_timeout: float):
+    with open(os.path.join(get_data_dir(), "daemon.log"), "a") as log:
+        return subprocess.Popen([sys.executable, "-m", "gpt_repl.daemon", "--idle-timeout", str(idle_timeout)],
+                                stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True)
+
+
+def stop_daemon():
+    try:
+        sock = connect()
+    except DaemonUnavailable:
+        return False
+    with sock:
+        sock.sendall(json.dumps({"command": "stop"}).encode() + b"\n")
+        sock.makefile("r").readline()
+    return True
+
+
+class DaemonClient:
+    """
+    front-end side of the daemon. start() spawns it in the background if it isn't running,
+    so it warms up while the user types; wait() blocks until it accepts connections, or
+    reports that it can't be reached and main() should fall back to in-process litellm
+    """
+
+    def __init__(self, idle_timeout: float = 1800, connect_timeout: float = 30):
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.process = None
+
+    def start(self):
+        if not hasattr(socket, "AF_UNIX") or daemon_running():
+            return
+        try:
+            self.process = spawn_daemon(self.idle_timeout)
+        except OSError:
+            self.process = None
+
+    def wait(self):
+        deadline = time.monotonic() + self.connect_timeout
+        while 1:
+            if daemon_running():
+                return True
+            spawned_and_alive = self.process is not None and self.process.poll() is None
+            if not spawned_and_alive or time.monotonic() > deadline:
+                return False
+            time.sleep(0.02)
+
+    def request(self, model: str, messages: list, stream: bool, kwargs: dict):
+        sock = connect()
+        sock.sendall(json.dumps({"model": model, "messages": messages, "stream": stream, "kwargs": kwargs}).encode() + b"\n")
+        return sock, sock.makefile("r", encoding="utf-8")
+
+    def completion(self, model: str, messages: list, stream: bool = False, **kwargs):
+        sock, reader = self.request(model, messages, stream, kwargs)
+        if stream:
+            return DaemonStream(sock, reader)
+        with sock:
+            return response_from(read_record(reader))
+
+
+class DaemonStream:
+
+    def __init__(self, sock, reader):
+        self.sock = sock
+        self.reader = reader
+
+    def __iter__(self):
+        with self.sock:
+            while 1:
+                record = read_record(self.reader)
+                if record.get("done"):
+                    # the finished message rides on the last chunk, StreamAccumulator picks it up
+                    chunk = make_chunk("", finish_reason=record.get("finish_reason"))
+                    chunk.final = record
+                    yield chunk
+                    return
+                yield make_chunk(record["delta"])
+
+    def close(self):
+        self.sock.close()
+
+
+def read_record(reader):
+    line = reader.readline()
+    if not line:
+        raise DaemonError("daemon closed the connection")
+    record = json.loads(line)
+    if "error" in record:
+        raise DaemonError(record["error"])
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gpt-repl completion daemon")
+    parser.add_argument("--idle-timeout", type=float, default=1800, help="exit after this many idle seconds")
+    parser.add_argument("--stub", action="store_true", help="echo prompts back instead of calling litellm")
+    args = parser.parse_args()
+    serve("stub" if args.stub else "litellm", args.idle_timeout)
+
+
+if __name__ == "__main__":
+    main()
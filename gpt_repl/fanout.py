@@ -0,0 +1,250 @@
+#################################################
+## file         : fanout.py
+## description  : send one prompt to several models
+##                at once and compare the answers
+##
+#################################################
+
+import re
+import sys
+import time
+import asyncio
+from functools import partial
+from types import SimpleNamespace
+from gpt_repl.render import render, color_codes, provider_color_table, terminal_size, char_width
+from gpt_repl.metrics import TurnMetrics
+from gpt_repl.backend import StreamAccumulator, interrupted_suffix
+from gpt_repl.input import getch
+
+def model_color(model: str):
+    return provider_color_table.get(model.split('/')[0], "green")
+
+
+class FanoutResult:
+
+    def __init__(self, model: str):
+        self.model = model
+        self.reply = StreamAccumulator()
+        self.chunks = 0
+        self.error = None
+        self.done = False
+        self.interrupted = False
+        self.turn = TurnMetrics(model)
+
+    @property
+    def content(self):
+        text = self.reply.text()
+        if self.interrupted:
+            text += interrupted_suffix(text)
+        return text
+
+
+class StatusBoard:
+    """
+    one live section per model, redrawn in place: a status line (state, chunks, time to first
+    token, elapsed) and under it the last lines of its answer as they stream in, in the model's
+    color. once every model is done the sections fold down to their status lines, which stay on
+    screen as the latency report, and the answers are rendered in full by pick_answer()
+    """
+
+    max_preview_rows = 8
+
+    def __init__(self, results):
+        self.results = results
+        self.start = time.perf_counter()
+        self.last_draw = 0.0
+        self.drawn = 0  # lines on screen from the last draw
+
+    def line(self, i: int, result: FanoutResult):
+        turn = result.turn
+        elapsed = (turn.end or time.perf_counter()) - self.start
+        color = color_codes[model_color(result.model)]
+        if result.error:
+            state = f"\x1b[91mfailed\x1b[0m {' '.join(result.error.split())}"
+        elif result.interrupted:
+            state = f"\x1b[90mstopped\x1b[0m    {result.chunks:>5} chunks"
+        elif result.done:
+            state = f"done       {result.chunks:>5} chunks"
+        elif turn.first_token_at:
+            state = f"streaming  {result.chunks:>5} chunks"
+        else:
+            state = "waiting   "
+        ttft = f"ttft {turn.first_token_at - turn.request_start:.2f}s" if turn.first_token_at and turn.request_start else ""
+        return f"  {color}{i}. {result.model:<36}\x1b[0m {state}  {ttft:<11} {elapsed:6.2f}s"
+
+    def draw(self, force: bool = False, previews: bool = True):
+        now = time.perf_counter()
+        if not force and now - self.last_draw < 0.1:
+            return
+        self.last_draw = now
+
+        columns, lines = terminal_size()
+        # the sections share the screen, each gets the same number of preview rows
+        rows = min(self.max_preview_rows, (lines - 2) // len(self.results) - 1) if previews else 0
+        output = []
+        for i, result in enumerate(self.results, 1):
+            output.append(clip(self.line(i, result), columns - 1))
+            if rows > 0:
+                color = color_codes[model_color(result.model)]
+                preview = tail_rows(result.reply.text(), columns - 6, rows)
+                preview += [""] * (rows - len(preview))  # fixed height, so sections don't jump around
+                output += [f"     {color}{row}\x1b[0m" for row in preview]
+
+        moved = f"\x1b[{self.drawn}A" if self.drawn else ""
+        sys.stdout.write(moved + "".join("\r\x1b[K" + line + "\n" for line in output) + "\x1b[J")
+        sys.stdout.flush()
+        self.drawn = len(output)
+
+    def finish(self):
+        self.draw(force=True, previews=False)
+
+
+_escape = re.compile(r"\x1b\[[0-?]*[ -/]*[@-~]")
+
+def clip(line: str, width: int):
+    # `line` cut to `width` visible columns, its color escapes kept, so it never wraps
+    out, col, i = "", 0, 0
+    while i < len(line):
+        escape = _escape.match(line, i)
+        if escape:
+            out += escape.group()
+            i = escape.end()
+            continue
+        w = char_width(line[i])
+        if col + w > width:
+            return out + "\x1b[0m"
+        out += line[i]
+        col += w
+        i += 1
+    return out
+
+
+def tail_rows(text: str, width: int, rows: int):
+    # the last `rows` screen rows of `text` wrapped at `width` columns, for a preview that
+    # never wraps on its own (so the board always knows how many lines it drew)
+    out = []
+    for line in text.split("\n")[-rows:]:
+        row, col = "", 0
+        for char in line.replace("\t", "    "):
+            if char < " " or char == "\x7f":
+                continue  # escapes and other control characters would move the cursor
+            w = char_width(char)
+            if col + w > width:
+                out.append(row)
+                row, col = "", 0
+            row += char
+            col += w
+        out.append(row)
+    return out[-rows:]
+
+
+async def stream_model(acompletion, result: FanoutResult, messages, board: StatusBoard):
+    result.turn.request_sent()
+    response = None
+    try:
+        response = await acompletion(model=result.model, messages=messages, stream=True)
+        async for chunk in response:
+            if result.reply.add(chunk):
+                result.turn.first_token()
+                result.chunks += 1
+                board.draw()
+    except asyncio.CancelledError:
+        # ctrl-c: stop generating, what arrived is kept (see fan_out)
+        await aclose_stream(response)
+        raise
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    result.turn.response_done(result.reply.usage or estimated_usage(result))
+    result.done = True
+    board.draw(force=True)
+
+
+def estimated_usage(result: FanoutResult):
+    # not every provider reports usage while streaming, 4 characters a token is close enough for tokens/sec
+    return SimpleNamespace(prompt_tokens=None, completion_tokens=len(result.reply.text()) // 4, total_tokens=None)
+
+
+async def aclose_stream(stream):
+    # the async twin of backend.close_stream(), provider streams close with a coroutine here
+    for obj in (stream, getattr(stream, "completion_stream", None)):
+        close = getattr(obj, "aclose", None) or getattr(obj, "close", None)
+        if callable(close):
+            try:
+                closing = close()
+                if asyncio.iscoroutine(closing):
+                    await closing
+            except Exception:
+                pass
+
+
+async def gather(acompletion, results, messages, board):
+    await asyncio.gather(*(stream_model(acompletion, result, messages, board) for result in results))
+
+
+def fan_out(models, messages, completion_kwargs: dict = None):
+    """
+    streams every model's answer at once, each into its own section of the board. ctrl-c
+    stops them all, like it stops a single reply: answers cut short keep what arrived (with the
+    interrupted marker), models that hadn't answered yet count as failed
+    """
+    from litellm import acompletion
+    acompletion = partial(acompletion, **(completion_kwargs or {}))  # e.g. api_base
+
+    results = [FanoutResult(model) for model in models]
+    board = StatusBoard(results)
+    print()
+    board.draw(force=True)
+    try:
+        asyncio.run(gather(acompletion, results, messages, board))
+    except KeyboardInterrupt:
+        # asyncio.run has already cancelled the streams (and each closed its own)
+        for result in results:
+            if result.done:
+                continue
+            if result.reply.text().strip():
+                result.interrupted = True
+                result.turn.response_done(estimated_usage(result))
+            else:
+                result.error = "cancelled"
+            result.done = True
+    board.finish()
+    return results
+
+
+def pick_answer(results, renderer: str):
+    # print every answer in its own section, then ask which one goes into the chat history
+    answered = [result for result in results if not result.error]
+    for i, result in enumerate(results, 1):
+        if result.error:
+            continue
+        color = model_color(result.model)
+        render(f"\x1b[1m{color_codes[color]}{i}. {result.model}:\x1b[0m {result.content}", color, renderer)
+
+    if not answered:
+        if all(result.error == "cancelled" for result in results):
+            print("\x1b[90mcancelled\x1b[0m\n")
+        else:
+            print("every model failed, nothing to commit\n")
+        return None
+    if len(answered) == 1:
+        return answered[0]
+
+    choices = "/".join(str(results.index(result) + 1) for result in answered)
+    prompt_str = f"Commit which answer to the chat? \x1b[96m[{choices}, enter = {results.index(answered[0]) + 1}]\x1b[0m"
+    sys.stdout.write(prompt_str)
+    sys.stdout.flush()
+    while 1:
+        choice = getch()
+        if choice in ('q', '\x03'):  # ctrl-c
+            sys.stdout.write("\r\x1b[K\x1b[90mnothing committed\x1b[0m\n\n")
+            sys.stdout.flush()
+            return None
+        if choice in ('\r', '\n'):
+            chosen = answered[0]
+            break
+        if choice.isdigit() and 1 <= int(choice) <= len(results) and results[int(choice) - 1] in answered:
+            chosen = results[int(choice) - 1]
+            break
+    sys.stdout.write(f"\r\x1b[K\x1b[90mcommitted {chosen.model}\x1b[0m\n\n")
+    sys.stdout.flush()
+    return chosen
@@ -15,6 +15,13 @@ Welcome to gpt-repl, a terminal-based gpt chat-bot!
 - `-h` or `--help`: Display this help message.
 - `-c <code_block_index>`: Copy a code block (1-N from top to bottom) to your clipboard. Only applies to most recent API response.
 - `-p <renderer>`: Re-print the current API response with a different text renderer ('raw', 'lite', or 'rich')
+- `-b [n]`: Show the n turns before the earliest one on screen (chats open with only their last `open_turns` turns).
+- `-retry`: Ask again for the last reply. The old one stays in the chat's `heads.log`.
+- `-fork [n]`: Continue in a new chat that shares the first n turns (all of them by default) with this one. Nothing is copied, both chats point at the same messages.
+- `-f <model>, <model>, ...`: Fan out: send each prompt to all of these models at once, then pick the answer to keep. `-f off` goes back to the configured model, `-f` alone shows the current setting.
+- `-stats`: Show time to first token, tokens/sec and where the time of each turn went, for this session and this chat, and how long saving chats takes.
+- `-nocache`: Ask the model again for the next prompt instead of answering it from the response cache (`cache = true` in the config).
+- `-s <query>`: Search the messages of every saved chat. Press `s` in the chat selector to filter chats the same way.
 
 ### How to Use
 
@@ -7,7 +7,6 @@
 import os
 import sys
 import re
-from prompt_toolkit import prompt
 from gpt_repl.render import count_lines, clear_lines
 
 def getch():
@@ -29,7 +28,20 @@ def getch():
             termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
         return ch
 
+def make_bindings():
+    from prompt_toolkit.key_binding import KeyBindings
+    bindings = KeyBindings()
+    @bindings.add("c-n")
+    def _(event):
+        event.current_buffer.insert_text("\n")
+    @bindings.add("c-r")
+    def _(event):
+        event.current_buffer.text = ""
+    return bindings
+
+
 def get_input(prev_input, bindings):
+    from prompt_toolkit import prompt  # not imported at startup, the chat selector doesn't need it
 
     user_input = prompt(": ", key_bindings=bindings, default=prev_input).strip()
 
@@ -47,6 +59,22 @@ def get_input(prev_input, bindings):
         return ('render', 'lite')
     elif re.match(r"^--?p\s+rich$", normalized_input):
         return ('render', 'rich')
+    elif re.match(r"^--?f(\s+\S.*)?$", normalized_input):
+        return ('fanout', "".join(user_input.split(maxsplit=1)[1:]).strip())
+    elif re.match(r"^--?b(\s+\d+)?$", normalized_input):
+        args = normalized_input.split()
+        return ('back', int(args[1]) if len(args) > 1 else None)
+    elif re.match(r"^--?fork(\s+\d+)?$", normalized_input):
+        args = normalized_input.split()
+        return ('fork', int(args[1]) if len(args) > 1 else None)
+    elif re.match(r"^--?retry$", normalized_input):
+        return ('retry', None)
+    elif re.match(r"^--?nocache$", normalized_input):
+        return ('nocache', None)
+    elif re.match(r"^--?stats$", normalized_input):
+        return ('stats', None)
+    elif re.match(r"^--?s\s+\S", normalized_input):
+        return ('search', user_input.split(maxsplit=1)[1])
     elif re.match(r"^--?[a-z]$", normalized_input) or re.match(r"^--?.\s", normalized_input):
         return ('invalid_command', None)
     else:
@@ -5,24 +5,31 @@
 #################################################
 
 import sys
+
+if "--startup-profile" in sys.argv:
+    # has to go in before any other import so they all get timed
+    from gpt_repl import startup
+    startup.install()
+
+import os
 import argparse
-import threading
-import importlib
-import shutil
-from prompt_toolkit.key_binding import KeyBindings
+from functools import partial
+from gpt_repl import startup, tracing
 from gpt_repl.config import get_config_path, open_conf_file, load_config
-from gpt_repl.spinner import Spinner
+from gpt_repl.spinner import StatusLine
 from gpt_repl.code_clipboard import copy_code_block
 from gpt_repl.help import help_runtime
-from gpt_repl.render import print_rule, render, count_lines, clear_lines, color_codes, provider_color_table
-from gpt_repl.chat import sel_chat, mkdir_new_chat, load_chat, print_chat, save_chat
-from gpt_repl.input import get_input
+from gpt_repl.render import print_rule, render, color_codes, provider_color_table, MarkdownStream, RichStream, RawStream, watch_terminal_size, use_render_cache
+from gpt_repl.chat import sel_chat, load_chat, fork_chat, print_chat, print_earlier, print_search
+from gpt_repl.writer import ChatWriter, exit_on_signals
+from gpt_repl.input import get_input, make_bindings
+from gpt_repl.context import ContextWindow
+from gpt_repl.metrics import TurnMetrics, MetricsLog
+from gpt_repl.backend import Backend, StreamAccumulator, close_stream, interrupted_suffix
+from gpt_repl.pipe import wants_pipe_mode, run_pipe
 
 def main():
 
-    load_thread = threading.Thread(target=importlib.import_module, args=("litellm",), daemon=True)
-    load_thread.start()
-
     messages = []
     response = ""
     prev_input = ""
@@ -30,24 +37,43 @@ def main():
     ### get args ################################
 
     parser = argparse.ArgumentParser(description="Terminal-based REPL GPT Chat Bot")
+    parser.add_argument("prompt", nargs="*", help="answer this prompt (plus anything piped to stdin) and exit")
+    parser.add_argument("--chat", nargs="?", const="new", metavar="ID", help="in pipe mode, save the turn to a chat: 'last', a chat id, or a new chat if no id is given")
+    parser.add_argument("--timing", action="store_true", help="in pipe mode, print request overhead and time to first byte to stderr")
     parser.add_argument("--config", action="store_true", help="open the config file")
+    parser.add_argument("--daemon-stop", action="store_true", help="stop the background completion daemon")
+    parser.add_argument("--startup-profile", action="store_true", help="print import times and time to the first prompt")
+    parser.add_argument("--profile", action="store_true", help="record a trace of every turn's spans to ~/.gpt-repl/profiles (or set GPT_REPL_PROFILE=1)")
+    parser.add_argument("--cprofile", action="store_true", help="like --profile, plus a cProfile dump per turn (or GPT_REPL_PROFILE=cprofile)")
+    parser.add_argument("--batch", metavar="IN_JSONL", help="answer every prompt in a jsonl file without the repl")
+    parser.add_argument("--out", metavar="OUT_JSONL", help="where --batch writes results (default: <input>.out.jsonl)")
+    parser.add_argument("--workers", type=int, help="concurrent requests for --batch")
+    parser.add_argument("--mock", metavar="TEXT", help="answer --batch prompts with TEXT locally instead of calling the provider")
+    parser.add_argument("--save-chats", action="store_true", help="also save each --batch conversation as a chat")
+    parser.add_argument("--migrate", action="store_true", help="move every chat into the message store and show the disk space saved")
     args = parser.parse_args()
 
     config_path = get_config_path("gpt.conf")
     if args.config:
         open_conf_file(config_path)
         sys.exit()
+    if args.daemon_stop:
+        from gpt_repl.daemon import stop_daemon
+        print("daemon stopped" if stop_daemon() else "daemon is not running")
+        sys.exit()
+    if args.migrate:
+        from gpt_repl.chat import migrate_chats
+        migrate_chats()
+        sys.exit()
+
+    profile = os.environ.get("GPT_REPL_PROFILE", "").lower()
+    if args.profile or args.cprofile or profile not in ("", "0", "false", "no"):
+        tracing.enable(cprofile=args.cprofile or profile == "cprofile")
 
     ### initialize classes ######################
 
-    spinner = Spinner(message="")
-    bindings = KeyBindings()
-    @bindings.add("c-n")
-    def _(event):
-        event.current_buffer.insert_text("\n")
-    @bindings.add("c-r")
-    def _(event):
-        event.current_buffer.text = ""
+    status = StatusLine()
+    watch_terminal_size()
 
     ### load configs ############################
 
@@ -56,6 +82,47 @@ def main():
     renderer = config['settings']['renderer']
     stream = config['settings']['stream']
     always_new_chat = config['settings']['always_new_chat']
+    open_turns = config['settings'].getint('open_turns', 10)
+    rich_fps = config['settings'].getfloat('rich_fps', 8)
+    context_budget = config['settings'].getint('context_budget', 0)
+    context_strategy = config['settings'].get('context_strategy', 'pinned')
+    context_pinned_turns = config['settings'].getint('context_pinned_turns', 1)
+    use_daemon = config['settings'].getboolean('daemon', False)
+    daemon_idle_timeout = config['settings'].getfloat('daemon_idle_timeout', 1800)
+    fanout_models = parse_models(config['settings'].get('fanout_models', ''))
+    use_cache = config['settings'].getboolean('cache', False)
+    api_base = config['settings'].get('api_base', '').strip()
+    completion_kwargs = {"api_base": api_base} if api_base else {}
+    if config['settings'].getboolean('render_cache', True):
+        from gpt_repl.cache import RenderCache
+        render_cache_bytes = config['settings'].getint('render_cache_mb', 20) * 1_000_000
+        use_render_cache(RenderCache(render_cache_bytes, render_cache_bytes))
+
+    if args.batch:
+        from gpt_repl.batch import run_batch, parse_rate_limits
+        ok = run_batch(args.batch, args.out or os.path.splitext(args.batch)[0] + ".out.jsonl", model,
+                       workers=args.workers or config['settings'].getint('batch_workers', 4),
+                       rate_limits=parse_rate_limits(config['settings'].get('batch_rate_limits', '')),
+                       retries=config['settings'].getint('batch_retries', 4),
+                       system_prompt=config['settings'].get('system-prompt'),
+                       mock_response=args.mock, save_chats=args.save_chats, api_base=api_base)
+        sys.exit(0 if ok else 1)
+
+    # start importing litellm (or waking the daemon) and the renderer while the user picks a chat and types
+    backend = Backend(use_daemon, daemon_idle_timeout)
+    cache = None
+    if use_cache:
+        from gpt_repl.cache import ResponseCache
+        cache = ResponseCache(config['settings'].getint('cache_max_mb', 50) * 1_000_000,
+                              config['settings'].getfloat('cache_max_age_days', 30) * 86400)
+
+    if wants_pipe_mode(args.prompt):
+        run_pipe(args.prompt, model, backend, chat=args.chat, timing=args.timing,
+                 system_prompt=config['settings'].get('system-prompt'), cache=cache,
+                 completion_kwargs=completion_kwargs)
+        sys.exit()
+
+    startup.warm_imports(renderer)
 
     ### assign color ############################
 
@@ -74,22 +141,40 @@ def main():
     else:
         selected_chat = sel_chat()
 
+    metrics = MetricsLog()
+    writer = ChatWriter(config['settings'].getboolean('background_writes', True))
+    exit_on_signals()
+    context = ContextWindow(model, context_budget, context_strategy, context_pinned_turns)
+
+    startup.wait_for_warm_imports()
+
     if selected_chat:
         messages = load_chat(selected_chat)
-        print_chat(selected_chat, renderer, color)
+        context.attach(selected_chat)
+        with tracing.span("print_chat"):
+            shown_from = print_chat(selected_chat, renderer, color, open_turns)
     else:
         is_new_chat = True
+        shown_from = 0
         print(f"\n\x1b[1m{color_codes[color]}{model}:\x1b[0m How can I help you today? \x1b[96m'-h' for help\x1b[0m")
         print_rule(color)
 
+    bindings = make_bindings()
+    if startup.profiling():
+        startup.report()
+
     ### MAIN REPL LOOP ##########################
 
     while 1:
 
         ### get user prompt/command #############
 
+        tracing.end_turn()
+        for error in writer.take_errors():
+            print(f"\x1b[91m{error}\x1b[0m\n")
         try:
-            action, data = get_input(prev_input, bindings)
+            with tracing.span("get_input"):
+                action, data = get_input(prev_input, bindings)
         except KeyboardInterrupt:
             break
 
@@ -104,12 +189,71 @@ def main():
         elif action == 'render':
             render(response, color, data)
             continue
+        elif action == 'back':
+            if selected_chat:
+                writer.flush()
+                shown_from = print_earlier(selected_chat, shown_from, data or open_turns or 10, renderer, color)
+            continue
+        elif action == 'search':
+            writer.flush()
+            print_search(data)
+            continue
+        elif action == 'stats':
+            print(metrics.summary(selected_chat))
+            if cache:
+                print(cache.summary())
+            print("\x1b[1mchat writes\x1b[0m\n" + writer.summary())
+            continue
+        elif action == 'nocache':
+            if cache:
+                cache.bypass_next = True
+                print("the next prompt will skip the response cache\n")
+            else:
+                print("the response cache is off (set `cache = true` in the config)\n")
+            continue
+        elif action == 'fanout':
+            if data.lower() not in ("", "off"):
+                fanout_models = parse_models(data)
+            elif data:
+                fanout_models = []
+            if fanout_models:
+                print(f"fan-out to: {', '.join(fanout_models)}\n")
+            else:
+                print(f"fan-out off, using {model}\n")
+            continue
+        elif action == 'fork':
+            if not selected_chat:
+                print("nothing to fork yet\n")
+                continue
+            writer.flush()
+            forked = fork_chat(selected_chat, data)
+            if forked is None:
+                print(f"this chat has no turn {data}\n")
+                continue
+            selected_chat = forked
+            messages = load_chat(selected_chat)
+            context.attach(selected_chat)
+            shown_from = print_chat(selected_chat, renderer, color, open_turns)
+            continue
         elif action == 'invalid_command':
             print("invalid command\n")
             continue
         elif action == 'input':
             user_input = data
             prev_input = ""
+            tracing.start_turn()
+        elif action == 'retry':
+            # the last prompt goes out again, its old reply stays reachable through heads.log
+            if len(messages) < 2 or messages[-1].get("role") != "assistant" or messages[-2].get("role") != "user":
+                print("nothing to retry\n")
+                continue
+            messages.pop()
+            user_input = messages.pop()["content"]
+            prev_input = ""
+            print(f"\x1b[90mretrying: {' '.join(str(user_input).split())[:60]}\x1b[0m")
+            if cache:
+                cache.bypass_next = True  # the same request again would just replay the cached reply
+            tracing.start_turn()
         elif action == 'cancel':
             prev_input = data
             continue
@@ -118,51 +262,175 @@ def main():
 
         ### send prompt to API ##################
 
-        spinner.start()
-        load_thread.join()
-        from litellm import completion, stream_chunk_builder
-        messages.append({"role": "user", "content": user_input})
-
-        if (stream == "true"):
-            response_obj = completion(model=model, messages=messages, stream=True)
-            spinner.stop()
-
-            prefix = f"\n\x1b[1m{color_codes[color]}{model}:\x1b[0m\n\n"
-            print(prefix, end="")
-            output = ""
-            chunks = []
-
-            for chunk in response_obj:
-                chunks.append(chunk)
-                delta = chunk.choices[0].delta.content or ""
-                print(delta, end="", flush=True)
-                output += delta
-                num_lines = count_lines(output)
-                if (num_lines > shutil.get_terminal_size().lines - 10):
-                    clear_lines(num_lines - 1)
-                    output = ""
-            
-            response_obj = stream_chunk_builder(chunks)
-            response = response_obj.choices[0].message.content
-            messages.append({"role": "assistant", "content": response})
-            response = f"\x1b[1m{color_codes[color]}{model}:\x1b[0m {response}"
-
-            num_lines = count_lines(output + prefix)
-            clear_lines(num_lines - 1)
+        if fanout_models:
+            # every model answers at once, then one of the answers is committed to the chat
+            from gpt_repl.fanout import fan_out, pick_answer, model_color  # asyncio is slow to import
+            messages.append({"role": "user", "content": user_input})
+            try:
+                completion = backend.get_completion(in_process=True)
+                request_messages = context.select(messages, partial(completion, **completion_kwargs))
+            except KeyboardInterrupt:
+                messages.pop()
+                prev_input = user_input
+                print("\n\x1b[90mcancelled\x1b[0m\n")
+                continue
+            results = fan_out(fanout_models, request_messages, completion_kwargs)
+            chosen = pick_answer(results, renderer)
+            if chosen is None:
+                messages.pop()
+                prev_input = user_input
+                for result in results:
+                    metrics.add(result.turn, selected_chat)
+                continue
+
+            turn = chosen.turn
+            turns = [result.turn for result in results]
+            chat_model = chosen.model
+            messages.append({"role": "assistant", "content": chosen.content})
+            response = f"\x1b[1m{color_codes[model_color(chat_model)]}{chat_model}:\x1b[0m {chosen.content}"
+            rendered = True
 
         else:
-            response_obj = completion(model=model, messages=messages)
-            response = response_obj.choices[0].message.content
-            messages.append({"role": "assistant", "content": response})
-            response = f"\x1b[1m{color_codes[color]}{model}:\x1b[0m {response}"
-            spinner.stop()
-        
-        if is_new_chat:
-            selected_chat = mkdir_new_chat(model, user_input)
-            is_new_chat = False
-
-        save_chat(selected_chat, messages, user_input, response)
-        render(response, color, renderer)
+            turn = TurnMetrics(model)
+            turns = [turn]
+            chat_model = model
+            status.start(model)
+            messages.append({"role": "user", "content": user_input})
+            try:
+                # ctrl-c while litellm loads or the context is summarized cancels like it does during the request
+                with turn.span("import_wait"):
+                    completion = backend.get_completion()
+                with turn.span("context"):
+                    request_messages = context.select(messages, partial(completion, **completion_kwargs))
+            except KeyboardInterrupt:
+                status.stop()
+                messages.pop()
+                prev_input = user_input
+                print("\n\x1b[90mcancelled\x1b[0m\n")
+                continue
+            if cache:
+                completion = cache.wrap(completion)
+
+            content, rendered = request_reply(completion, model, request_messages, color, renderer, stream == "true",
+                                              status, turn, rich_fps, completion_kwargs)
+            if content is None:
+                messages.pop()
+                prev_input = user_input
+                continue
+            messages.append({"role": "assistant", "content": content})
+            response = f"\x1b[1m{color_codes[color]}{model}:\x1b[0m " + content
+
+        with turn.span("save"):
+            if is_new_chat:
+                selected_chat = writer.create(chat_model, user_input)
+                context.attach(selected_chat)
+                is_new_chat = False
+
+            writer.save(selected_chat, messages, chat_model)
+        if not rendered:
+            with turn.span("render"):
+                render(response, color, renderer)
+
+        for turn in turns:
+            metrics.add(turn, selected_chat)
+
+    writer.close()
+
+def request_reply(completion, model: str, request_messages: list, color: str, renderer: str, stream: bool,
+                  status: StatusLine, turn: TurnMetrics, rich_fps: float = 8, completion_kwargs: dict = None):
+    """
+    one turn's request: sends it, streams the reply and renders it as it arrives (when
+    streaming) and stops the status line. returns (reply, rendered), or (None, False) if
+    ctrl-c cancelled it before anything arrived. benchmarks/turn.py drives this too
+    """
+    completion_kwargs = completion_kwargs or {}
+    header = f"\x1b[1m{color_codes[color]}{model}:\x1b[0m "
+
+    if not stream:
+        try:
+            turn.request_sent()
+            with turn.span("request"):
+                response_obj = completion(model=model, messages=request_messages, **completion_kwargs)
+        except KeyboardInterrupt:
+            status.stop()
+            print("\n\x1b[90mcancelled\x1b[0m\n")
+            return None, False
+        turn.response_done(getattr(response_obj, "usage", None))
+        status.stop()
+        return response_obj.choices[0].message.content, False
+
+    reply = StreamAccumulator()  # folds the chunks as they come, none of them are kept
+    response_obj = None
+    md_stream = None
+    interrupted = False
+    try:
+        turn.request_sent()
+        with turn.span("request"):
+            response_obj = completion(model=model, messages=request_messages, stream=True, **completion_kwargs)
+
+        # the status line stays up while streaming, so output goes through it
+        if renderer == "lite":
+            # lines are formatted as soon as they finish, so there is nothing to clear and re-render
+            md_stream = MarkdownStream()
+            status.write("\n" + md_stream.feed(header))
+        elif renderer == "rich":
+            status.detach()  # rich.live owns the bottom of the screen, the status goes in there
+            print(f"\n\x1b[1m{color_codes[color]}{model}:\x1b[0m", flush=True)
+            md_stream = RichStream(rich_fps, status.text)
+        else:
+            md_stream = RawStream(header, out=status)
+
+        for chunk in tracing.chunks(response_obj):
+            delta = reply.add(chunk)
+            if delta:
+                turn.first_token()
+                status.token(delta)
+            with turn.span("render"):
+                if renderer == "lite":
+                    status.write(md_stream.feed(delta))
+                else:
+                    md_stream.feed(delta)
+    except KeyboardInterrupt:
+        # ctrl-c: stop generating now and keep whatever arrived
+        interrupted = True
+        close_stream(response_obj)
+    status.stop()
+
+    if interrupted:
+        partial = reply.text()
+        if not partial.strip():
+            if renderer == "rich" and md_stream:
+                md_stream.finish()
+            print("\n\x1b[90mcancelled\x1b[0m\n")
+            return None, False
+        content = partial + interrupted_suffix(partial)
+        turn.response_done()
+        with turn.span("render"):
+            if renderer == "lite":
+                print(md_stream.feed(content[len(partial):]), end="")
+            else:
+                md_stream.feed(content[len(partial):])
+    else:
+        with tracing.span("final_response", chunks=reply.chunks):
+            response_obj = reply.response(model, request_messages)
+        turn.response_done(getattr(response_obj, "usage", None))
+        content = response_obj.choices[0].message.content
+
+    with turn.span("render"):
+        if renderer == "lite":
+            print(md_stream.finish())
+            print_rule(color)
+        elif renderer == "rich":
+            md_stream.finish()
+            print_rule(color)
+        else:
+            md_stream.finish(header + content, color)
+    return content, True
+
+
+
+def parse_models(models: str):
+    return [model.strip() for model in models.split(',') if model.strip()]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+#################################################
+## file         : metrics.py
+## description  : per-turn latency, throughput and
+##                token usage, saved to each chat's
+##                metrics.jsonl
+##
+#################################################
+
+import os
+import json
+import time
+from contextlib import contextmanager
+from gpt_repl import tracing
+
+class TurnMetrics:
+    """
+    timings for one prompt -> reply turn. spans are summed by name, so a span that is
+    entered once per chunk (e.g. render while streaming) adds up over the whole turn.
+    with `--profile` every span also goes to the session's trace
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.start = time.perf_counter()
+        self.spans = {}
+        self.request_start = None
+        self.first_token_at = None
+        self.end = None
+        self.usage = {}
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.spans[name] = self.spans.get(name, 0.0) + end - start
+            if tracing.active:
+                tracing.event(name, start, end)
+
+    def request_sent(self):
+        self.request_start = time.perf_counter()
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def response_done(self, usage=None):
+        self.end = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = self.end  # not streamed, the whole reply is the first token
+        if usage:
+            self.usage = {key: getattr(usage, key, None) for key in ("prompt_tokens", "completion_tokens", "total_tokens")}
+
+    def record(self):
+        record = {
+            "time": time.time(),
+            "model": self.model,
+            "spans": {name: round(seconds, 4) for name, seconds in self.spans.items()},
+            "ttft": None,
+            "tokens_per_sec": None,
+            "total": round(time.perf_counter() - self.start, 4),
+            **self.usage,
+        }
+        if self.request_start is not None and self.end is not None:
+            record["ttft"] = round(self.first_token_at - self.request_start, 4)
+            generating = self.end - self.first_token_at
+            if not generating:
+                generating = self.end - self.request_start  # non-streamed replies arrive all at once
+            if self.usage.get("completion_tokens") and generating > 0:
+                record["tokens_per_sec"] = round(self.usage["completion_tokens"] / generating, 1)
+        return record
+
+
+class MetricsLog:
+    # keeps this session's records in memory and appends them to the chat's metrics.jsonl
+
+    def __init__(self):
+        self.session = []
+        self.pending = []  # records of a new chat that doesn't have a directory yet
+
+    def add(self, turn: TurnMetrics, chat_dir=None):
+        record = turn.record()
+        self.session.append(record)
+        self.pending.append(record)
+        if chat_dir:
+            self.flush(chat_dir)
+
+    def flush(self, chat_dir):
+        if not self.pending:
+            return
+        with open(os.path.join(chat_dir, "metrics.jsonl"), "a") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in self.pending))
+        self.pending = []
+
+    def summary(self, chat_dir=None):
+        output = "\n\x1b[1mthis session\x1b[0m\n" + summarize(self.session)
+        if chat_dir:
+            output += "\n\x1b[1mthis chat\x1b[0m\n" + summarize(load_metrics(chat_dir) + self.pending)
+        return output
+
+
+def load_metrics(chat_dir):
+    path = os.path.join(chat_dir, "metrics.jsonl")
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def percentile(values, p: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def fmt(value, unit: str = "s"):
+    if value is None:
+        return "-"
+    return f"{value:.2f}{unit}" if unit == "s" else f"{value:.1f}"
+
+
+def summarize(records):
+    if not records:
+        return "  no turns yet\n"
+
+    by_model = {}
+    for record in records:
+        by_model.setdefault(record["model"], []).append(record)
+
+    output = f"  {'model':<36} {'turns':>5} {'ttft p50':>9} {'ttft p95':>9} {'tok/s p50':>10} {'tok/s p95':>10} {'tokens':>8}\n"
+    for model, model_records in by_model.items():
+        ttfts = [r["ttft"] for r in model_records if r.get("ttft") is not None]
+        rates = [r["tokens_per_sec"] for r in model_records if r.get("tokens_per_sec") is not None]
+        tokens = sum(r.get("total_tokens") or 0 for r in model_records)
+        output += (f"  {model:<36} {len(model_records):>5} {fmt(percentile(ttfts, 50)):>9} {fmt(percentile(ttfts, 95)):>9}"
+                   f" {fmt(percentile(rates, 50), ''):>10} {fmt(percentile(rates, 95), ''):>10} {tokens:>8}\n")
+
+    # where the time of an average turn goes
+    spans = {}
+    for record in records:
+        for name, seconds in record["spans"].items():
+            spans[name] = spans.get(name, 0.0) + seconds
+    output += "  avg per turn: " + ", ".join(f"{name} {seconds / len(records):.3f}s" for name, seconds in spans.items())
+    output += f", total {sum(r['total'] for r in records) / len(records):.3f}s\n"
+    return output
@@ -0,0 +1,102 @@
+#################################################
+## file         : pipe.py
+## description  : one-shot mode for shell scripts,
+##                `git diff | gpt "review this"`
+##
+#################################################
+
+import os
+import sys
+import time
+from gpt_repl import startup
+from gpt_repl.backend import StreamAccumulator
+
+def wants_pipe_mode(prompt_args):
+    # a prompt on the command line, or stdin/stdout hooked up to something other than a terminal
+    return bool(prompt_args) or not sys.stdin.isatty() or not sys.stdout.isatty()
+
+
+def resolve_chat(chat: str):
+    from gpt_repl.config import get_chats_dir
+    from gpt_repl.catalog import sync_catalog, catalog_page
+
+    if chat == "new":
+        return None
+    if chat == "last":
+        sync_catalog()
+        page = catalog_page(0, 1)
+        return page[0][0] if page else None
+    chat_dir = os.path.join(get_chats_dir(), chat)
+    if not os.path.isdir(chat_dir):
+        sys.stderr.write(f"gpt: no chat named '{chat}'\n")
+        sys.exit(2)
+    return chat_dir
+
+
+def run_pipe(prompt_args, model: str, backend, chat: str = None, system_prompt: str = None, timing: bool = False, cache=None,
+             completion_kwargs: dict = None):
+    """
+    streams the reply to stdout as plain text: no spinner, no line clearing, no prompt_toolkit.
+    with `chat` the turn is appended to a saved chat ('last', a chat id, or 'new')
+    """
+
+    stdin_text = "" if sys.stdin.isatty() else sys.stdin.read()
+    user_input = "\n\n".join(part for part in (" ".join(prompt_args), stdin_text) if part.strip())
+    if not user_input:
+        sys.stderr.write("gpt: nothing to send, pass a prompt or pipe text to stdin\n")
+        sys.exit(2)
+
+    chat_dir = resolve_chat(chat) if chat else None
+    if chat_dir:
+        from gpt_repl.chat import load_chat
+        messages = load_chat(chat_dir)
+    elif system_prompt:
+        messages = [{"role": "system", "content": system_prompt}]
+    else:
+        messages = []
+    messages.append({"role": "user", "content": user_input})
+
+    completion = backend.get_completion()
+    if cache:
+        completion = cache.wrap(completion)
+    request_sent = time.perf_counter()
+    first_byte = None
+    reply = StreamAccumulator()
+    out = sys.stdout
+
+    try:
+        for chunk in completion(model=model, messages=messages, stream=True, **(completion_kwargs or {})):
+            delta = reply.add(chunk)
+            if not delta:
+                continue
+            if first_byte is None:
+                first_byte = time.perf_counter()
+            out.write(delta)
+            out.flush()
+        if reply.parts and not reply.parts[-1].endswith("\n"):
+            out.write("\n")
+        out.flush()
+    except BrokenPipeError:
+        # reader went away (e.g. `| head`), stop quietly
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, out.fileno())
+
+    done = time.perf_counter()
+    response = reply.text()
+
+    if chat:
+        from gpt_repl.chat import mkdir_new_chat, save_chat
+        messages.append({"role": "assistant", "content": response})
+        if chat_dir is None:
+            chat_dir = mkdir_new_chat(model, user_input)
+        save_chat(chat_dir, messages, model)
+        sys.stderr.write(f"saved to chat {os.path.basename(chat_dir)}\n")
+
+    if timing:
+        # overhead = everything before the request went out, the rest is the provider
+        startup_time = request_sent - startup._start
+        offset = startup.process_start_offset() or 0.0
+        ttfb = (first_byte or done) - request_sent
+        sys.stderr.write(f"overhead before request: {(startup_time + offset) * 1000:.1f}ms "
+                         f"({offset * 1000:.1f}ms interpreter), first byte after request: {ttfb * 1000:.1f}ms, "
+                         f"total: {(done - request_sent + startup_time + offset) * 1000:.1f}ms\n")
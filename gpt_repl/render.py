@@ -4,15 +4,17 @@
 ##
 #################################################
 
+import os
 import sys
 import re
 import shutil
-import ansiwrap_hotoffthehamster # stdlib textwrap does not recognize ansi esc codes, use ansiwrap
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name
-from pygments.lexers.special import TextLexer
-from pygments.formatters import Terminal256Formatter
-from pygments.styles import get_style_by_name
+import time
+import signal
+import unicodedata
+from gpt_repl import tracing
+
+# pygments and ansiwrap are imported where they're used (or warmed up in the background
+# by startup.py), so printing the chat selector doesn't wait on them
 
 color_codes = {
     "red": "\x1b[91m",
@@ -35,124 +37,553 @@ provider_color_table = {
 }
 
 def print_rule(color: str):
+    print(rule_str(color))
+
+
+def rule_str(color: str):
 
     if color not in color_codes:
         color = "green"  # default color if an invalid color is specified
 
-    rule = "─" * shutil.get_terminal_size().columns
-    colored_rule = color_codes[color] + rule + color_codes["reset"]
-    print(colored_rule)
+    rule = "─" * terminal_size().columns
+    return color_codes[color] + rule + color_codes["reset"]
 
 
-def count_lines(print_str: str):
+_term_size = None
+_watching_size = False
+
+def _on_winch(signum, frame):
+    global _term_size
+    _term_size = None
+
+
+def watch_terminal_size():
+    # cache the terminal size and only re-query it after a SIGWINCH (resize)
+    global _watching_size
+    if _watching_size or not hasattr(signal, "SIGWINCH"):
+        return
+    try:
+        prev_handler = signal.getsignal(signal.SIGWINCH)
+        def handler(signum, frame):
+            _on_winch(signum, frame)
+            if callable(prev_handler):
+                prev_handler(signum, frame)
+        signal.signal(signal.SIGWINCH, handler)
+    except ValueError:
+        return  # signals can only be installed from the main thread
+    _watching_size = True
+
+
+def terminal_size():
+    global _term_size
+    if not _watching_size:
+        return shutil.get_terminal_size()
+    if _term_size is None:
+        _term_size = shutil.get_terminal_size()
+    return _term_size
+
+
+def char_width(char: str):
+    if unicodedata.combining(char):
+        return 0
+    if unicodedata.east_asian_width(char) in ('W', 'F'):
+        return 2
+    return 1
+
 
-    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    print_str = ansi_escape.sub('', print_str)
-    print_str = print_str.expandtabs()
-    
-    width = shutil.get_terminal_size().columns
-    total_rows = 0
-
-    for line in print_str.split('\n'):
-        if line:
-            implicit_rows = (len(line) + width - 1) // width
-            total_rows += implicit_rows
+_plain_run = re.compile(r'[ -~]+')
+
+class LineCounter:
+    """
+    incremental version of count_lines(), fed one chunk at a time.
+    tracks the current column and the rows used by finished lines, so each
+    feed() only costs O(len(text)) instead of re-scanning everything printed so far.
+    ansi escapes split across chunk boundaries are held in self.esc until complete.
+    """
+
+    def __init__(self, width: int = None):
+        self.width = width
+        self.reset()
+
+    def reset(self):
+        self.done_rows = 0  # rows taken by lines that already ended with '\n'
+        self.col = 0        # visible width of the current (unfinished) line
+        self.esc = ""       # pending, incomplete ansi escape sequence
+
+    @property
+    def rows(self):
+        width = self.width or terminal_size().columns
+        return self.done_rows + max(1, (self.col + width - 1) // width)
+
+    def feed(self, text: str):
+        i = 0
+        n = len(text)
+        while i < n:
+            if self.esc:
+                char = text[i]
+                i += 1
+                self._feed_esc(char)
+                continue
+
+            m = _plain_run.match(text, i)
+            if m:
+                self.col += m.end() - i
+                i = m.end()
+                continue
+
+            char = text[i]
+            i += 1
+            self._feed_char(char)
+        return self
+
+    def _feed_char(self, char: str):
+        if char == '\n':
+            self.done_rows = self.rows
+            self.col = 0
+        elif char == '\t':
+            self.col += 8 - self.col % 8
+        elif char == '\x1b':
+            self.esc = char
         else:
-            total_rows += 1
+            self.col += char_width(char)
+
+    def _feed_esc(self, char: str):
+        # mirrors r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])'
+        self.esc += char
+        if len(self.esc) == 2:
+            if char == '[':
+                return
+            if '@' <= char <= 'Z' or '\\' <= char <= '_':
+                self.esc = ""
+                return
+        elif '@' <= char <= '~':
+            self.esc = ""
+            return
+        elif ' ' <= char <= '?':
+            return
 
-    return total_rows
+        # not a valid escape sequence, so its characters are visible text
+        pending = self.esc
+        self.esc = ""
+        self.col += 1
+        self.feed(pending[1:])
+
+
+def count_lines(print_str: str):
+    with tracing.span("count_lines", chars=len(print_str)):
+        return LineCounter().feed(print_str).rows
 
 
 def clear_lines(num_lines: int):
     if num_lines > 0:
-        sys.stdout.write(f"\x1b[{num_lines}A")  # move cursor up num_lines
-        sys.stdout.write("\r\x1b[J")            # clear from cursor to end of screen
-        sys.stdout.flush()
+        with tracing.span("clear_lines", lines=num_lines):
+            sys.stdout.write(f"\x1b[{num_lines}A")  # move cursor up num_lines
+            sys.stdout.write("\r\x1b[J")            # clear from cursor to end of screen
+            sys.stdout.flush()
+
+
+_render_cache = None
 
+def use_render_cache(cache):
+    # a cache.RenderCache, or None to always render from scratch
+    global _render_cache
+    _render_cache = cache
 
-def render(markdown_str: str, color: str, renderer: str):
+
+def render(markdown_str: str, color: str, renderer: str, chat_dir=None):
+    # with a render cache, lite and rich output is kept per (content, renderer, width, style),
+    # and on disk in `chat_dir` when given. only whole chats being reprinted pass one (print_chat,
+    # print_earlier), a single reply rendered again (-p) is still in memory
 
     if renderer == "raw":
         print(f"\n{markdown_str}")
         print_rule(color)
         print()
+        return
 
-    elif renderer == "lite":
-        print(f"\n{md2ansi(markdown_str)}")
-        print_rule(color)
+    output = None
+    if _render_cache:
+        key = _render_cache.key(markdown_str, renderer, terminal_size().columns, render_style(color, renderer))
+        output = _render_cache.get(key, chat_dir)
+
+    if output is not None:
+        sys.stdout.write(output)
+        sys.stdout.flush()
+        return
 
+    if renderer == "lite":
+        with tracing.span("md2ansi", chars=len(markdown_str)):
+            output = f"\n{md2ansi(markdown_str)}\n{rule_str(color)}\n"
     else:
+        with tracing.span("render_rich", chars=len(markdown_str)):
+            output = render_rich(markdown_str, color) + "\n"
+    # on screen first, the cache write (maybe to disk) happens after
+    sys.stdout.write(output)
+    sys.stdout.flush()
+    if _render_cache:
+        _render_cache.put(key, output, chat_dir)
+
+
+def render_style(color: str, renderer: str):
+    # everything besides the content and width that changes the output
+    if renderer == "lite":
+        return f"{color}/monokai"
+    # rich picks its colors from the environment, and drops them when not writing to a terminal
+    env = "/".join(os.environ.get(name, "") for name in ("TERM", "COLORTERM", "NO_COLOR", "FORCE_COLOR"))
+    return f"{color}/{env}/{sys.stdout.isatty()}"
+
+
+class RawStream:
+    """
+    streams a reply for the raw renderer. the deltas are already the reply as render() prints
+    it, so finish() only has to add what comes after it instead of clearing and reprinting
+    """
+
+    def __init__(self, header: str, out=None):
+        from gpt_repl.screen import Screen
+        self.screen = Screen(out)
+        self.screen.write("\n" + header)
+
+    def feed(self, delta: str):
+        self.screen.write(delta)
+
+    def finish(self, markdown_str: str, color: str):
+        # same output as render(markdown_str, color, "raw")
+        self.screen.update(f"\n{markdown_str}\n{rule_str(color)}\n\n")
+
+
+_console = None
+
+def rich_console():
+    # one Console for the whole session, it re-reads the terminal width itself
+    global _console
+    if _console is None:
         from rich.console import Console
-        from rich.markdown import Markdown
-        from rich.panel import Panel
-        console = Console()
-        md = Markdown(markdown_str)
-        panel = Panel(md, border_style=color, padding=(1,2), expand=False)
+        _console = Console()
+    return _console
+
+
+def render_rich(markdown_str: str, color: str):
+    from rich.markdown import Markdown
+    from rich.panel import Panel
+    console = rich_console()
+    md = Markdown(markdown_str)
+    panel = Panel(md, border_style=color, padding=(1,2), expand=False)
+    with console.capture() as capture:
         console.print(panel)
-        print()
+    return capture.get()
 
 
-def md2ansi(md: str):
+class RichStream:
+    """
+    streams a reply through rich. finished blocks (paragraphs, lists, code blocks) are printed
+    once, above a rich.live.Live area that shows the block still being written. only that
+    trailing block is parsed again, and at most `fps` times a second, so the cost of a refresh
+    doesn't grow with the length of the reply.
+    the live area shows at most the last screenful of the trailing block: rich can't move the
+    cursor above the top of the screen to redraw a taller one, each refresh would leave a copy of
+    its top in the scrollback. the whole block is printed once it's finished
+    """
 
-    lines = md.split('\n')
-    output = []
-    in_code_block = False
-    code_block_language = None
-    code_block_content = []
-    code_snippets = []
-    style = get_style_by_name("monokai")
+    def __init__(self, fps: float = 8, status=None):
+        from rich.live import Live
+        self.console = rich_console()
+        self.status = status    # returns a status line shown under the trailing block
+        self.interval = 1 / fps if fps > 0 else 0
+        self.partial = []       # pieces of the current, unfinished line
+        self.block = []         # finished lines of the trailing block
+        self.in_code_block = False
+        self.last_refresh = 0
+        self.live = Live(console=self.console, auto_refresh=False, vertical_overflow="crop")
+        self.live.start()
 
-    for line in lines:
+    def feed(self, delta: str):
+        if '\n' in delta:
+            head, *lines = delta.split('\n')
+            self.partial.append(head)
+            lines.insert(0, ''.join(self.partial))
+            self.partial = [lines.pop()]
+            for line in lines:
+                self._line(line)
+        else:
+            self.partial.append(delta)
+
+        now = time.monotonic()
+        if now - self.last_refresh >= self.interval:
+            self.last_refresh = now
+            self.live.update(self._tail(), refresh=True)
+
+    def finish(self):
+        # the live area is cleared and the rest printed in full, it may be taller than the screen
+        from rich.console import Group
+        from rich.markdown import Markdown
+        rest = '\n'.join(self.block + [''.join(self.partial)])
+        self.live.update(Group(), refresh=True)
+        self.live.stop()
+        if rest.strip():
+            self.console.print(Markdown(rest))
+
+    def _line(self, line: str):
         if line.strip().startswith('```'):
-            if in_code_block:
+            self.in_code_block = not self.in_code_block
+        if line.strip() or self.in_code_block:
+            self.block.append(line)
+        elif self.block:
+            # a blank line outside of a code block ends the block, it won't change anymore.
+            # the live area moves on first, so it isn't drawn again below the printed block
+            from rich.console import Group
+            from rich.markdown import Markdown
+            from rich.text import Text
+            finished = Markdown('\n'.join(self.block))
+            self.block = []
+            self.live.update(self._tail())
+            self.console.print(Group(finished, Text()))
+
+    def _tail(self):
+        from rich.markdown import Markdown
+        tail = Markdown('\n'.join(self.block + [''.join(self.partial)]))
+        if self.status:
+            from rich.console import Group
+            from rich.text import Text
+            tail = Group(tail, Text(self.status(), style="grey50"))
+        return LastRows(tail, self.console.size.height - 1)
+
+
+class LastRows:
+    # a rich renderable showing only the last `rows` rows of another one
+
+    def __init__(self, renderable, rows: int):
+        self.renderable = renderable
+        self.rows = max(1, rows)
+
+    def __rich_console__(self, console, options):
+        from rich.segment import Segment
+        lines = console.render_lines(self.renderable, options.update(height=None), pad=False)
+        for line in lines[-self.rows:]:
+            yield from line
+            yield Segment.line()
+
+
+def md2ansi(md: str, width: int = None):
+    stream = MarkdownStream(width)
+    return stream.feed(md) + stream.finish()
+
+
+### markdown ################################
+
+# compiled once here instead of on every line
+_inline_code = re.compile(r'`(.*?)`')
+_bold = re.compile(r'(\*\*|__)(.*?)\1')
+_header = re.compile(r'(#{1,6})\s*(.*)')
+_unordered = re.compile(r'\s*([\*\-\+])\s+(.*)')
+_ordered = re.compile(r'(\d+\.)\s+(.*)')
+_unusual_text = re.compile(r'[^\S ]|\x1b')     # whitespace other than spaces, or escapes of its own
+_spaces = re.compile(r'( +)')
+_ansi = re.compile('\x1b\\[(K|.*?m)')  # what ansiwrap counts as zero width
+
+_code_placeholder = '1NL1NECODE'
+
+_formatter = None
+_lexers = {}
+
+def code_formatter():
+    # the style and formatter are the same for every code block, build them once
+    global _formatter
+    if _formatter is None:
+        from pygments.styles import get_style_by_name
+        from pygments.formatters import Terminal256Formatter
+        _formatter = Terminal256Formatter(style=get_style_by_name("monokai"))
+    return _formatter
+
+
+def code_lexer(language: str):
+    lexer = _lexers.get(language)
+    if lexer is None:
+        from pygments.lexers import get_lexer_by_name
+        from pygments.lexers.special import TextLexer
+        try:
+            lexer = get_lexer_by_name(language)
+        except Exception:
+            lexer = TextLexer()
+        _lexers[language] = lexer
+    return lexer
+
+
+def format_inline(line: str):
+    # one line of normal text: inline code, bold, headers and lists, in the order md2ansi
+    # has always applied them. the regexes only run when the line can contain their syntax
+
+    code_snippets = []
+    if '`' in line:
+        # inline code is swapped for placeholders so the other rules don't touch it
+        def stash(m):
+            code_snippets.append(m.group(1))
+            return _code_placeholder
+        line = _inline_code.sub(stash, line)
+
+    if '**' in line or '__' in line:
+        line = _bold.sub(lambda m: f"\x1b[1m{m.group(2)}\x1b[0m", line)                                 # bold
+
+    m = _header.match(line)
+    if m:
+        line = f"\x1b[1;35m{' ' * len(m.group(1))} {m.group(2)}\x1b[0m" + line[m.end():]               # headers in magenta
+    m = _unordered.match(line)
+    if m:
+        line = f"  \x1b[93m•\x1b[0m {m.group(2)}" + line[m.end():]                                     # unordered lists
+    m = _ordered.match(line)
+    if m:
+        line = f"  \x1b[93m{m.group(1)}\x1b[0m {m.group(2)}" + line[m.end():]                          # ordered lists
+
+    # replace all inline code placeholders in this line w/ real code
+    for snippet in code_snippets:
+        line = line.replace(_code_placeholder, f"\x1b[1;36m{snippet}\x1b[0m", 1)
+
+    return line
+
+
+def style_left_open(rows: list):
+    # whether any row ends inside a style, i.e. its last escape isn't a reset
+    # (or it has none and the row before it ended inside one)
+    open_style = False
+    for row in rows:
+        last = row.rfind('\x1b[')
+        if last >= 0:
+            open_style = not row.startswith('\x1b[0m', last)
+        if open_style:
+            return True
+    return False
+
+
+class MarkdownStream:
+    """
+    streaming version of md2ansi(): feed() it deltas as they arrive and it returns the
+    formatted text of every line finished since the last call. fenced code blocks are
+    held back until their closing fence so they can be highlighted in one go.
+    stream.feed(md) + stream.finish() == md2ansi(md)
+    the terminal width is read once, when the stream is created
+    """
+
+    def __init__(self, width: int = None):
+        self.partial = []   # pieces of the current, unfinished line
+        self.started = False
+        self.in_code_block = False
+        self.code_block_language = None
+        self.code_block_content = []
+        self.width = width or terminal_size().columns
+
+    def feed(self, delta: str):
+        if '\n' not in delta:
+            self.partial.append(delta)
+            return ""
+
+        head, *lines = delta.split('\n')
+        self.partial.append(head)
+        lines.insert(0, ''.join(self.partial))
+        self.partial = [lines.pop()]
+
+        return ''.join(self._line(line) for line in lines)
+
+    def finish(self):
+        # the last line never gets its newline
+        line = ''.join(self.partial)
+        self.partial = []
+        return self._line(line)
+
+    def _emit(self, formatted: str):
+        # lines are joined with '\n', so every line but the first is prefixed with one
+        if self.started:
+            return '\n' + formatted
+        self.started = True
+        return formatted
+
+    def _line(self, line: str):
+        if '```' in line and line.strip().startswith('```'):
+            if self.in_code_block:
                 # end of code block, process it
+                from pygments import highlight
                 try:
-                    lexer = get_lexer_by_name(code_block_language)
-                except Exception:
-                    lexer = TextLexer()
-                try:
-                    formatted_code = highlight('\n'.join(code_block_content), lexer, Terminal256Formatter(style=style))
+                    lexer = code_lexer(self.code_block_language)
+                    formatted_code = highlight('\n'.join(self.code_block_content), lexer, code_formatter())
                     formatted_code = f"\x1b[48;5;235m{formatted_code}\x1b[0m"
-                    output.append(formatted_code)
+                    output = self._emit(formatted_code)
                 except Exception as e:
                     print(f"Error formatting code block: {str(e)}")
-                    output.append('\n'.join(code_block_content))
-                in_code_block = False
-                code_block_language = None
-                code_block_content = []
+                    output = self._emit('\n'.join(self.code_block_content))
+                self.in_code_block = False
+                self.code_block_language = None
+                self.code_block_content = []
+                return output
             else:
                 # start of code block
-                in_code_block = True
-                code_block_language = line.strip('` ')  # removes all three backticks and any whitespace from beginning of string, leaving only language
-            continue
+                self.in_code_block = True
+                self.code_block_language = line.strip('` ')  # removes all three backticks and any whitespace from beginning of string, leaving only language
+            return ""
 
-        if in_code_block:
-            code_block_content.append(line)
-        else:
+        if self.in_code_block:
+            self.code_block_content.append(line)
+            return ""
+
+        # process normal text
+        formatted = format_inline(line)
+        return self._emit(self._wrap(line, formatted))
+
+    def _wrap(self, line: str, formatted: str):
+        width = self.width
+
+        if width > 0 and not _unusual_text.search(line):
+            lines = self._wrap_words(formatted)
+            if lines is not None:
+                if len(lines) > 1 and '\x1b' in formatted and style_left_open(lines):
+                    # styles split across rows are closed and reopened, as ansiwrap does
+                    from ansiwrap_hotoffthehamster import ansi_terminate_lines
+                    lines = ansi_terminate_lines(lines)
+                return '\n'.join(lines)
+
+        import ansiwrap_hotoffthehamster # stdlib textwrap does not recognize ansi esc codes, use ansiwrap
+        try:
+            return ansiwrap_hotoffthehamster.fill(formatted, width=width, replace_whitespace=True,
+                                                  drop_whitespace=True, break_on_hyphens=False)
+        except Exception as e:
+            print(f"Error wrapping text: {str(e)}")
+            return formatted
+
+    def _wrap_words(self, text: str):
+        """
+        the greedy word wrap textwrap does inside ansiwrap.fill(), for text whose only whitespace
+        is spaces and whose only escapes are the ones format_inline adds. returns None when a
+        word is wider than a row, ansiwrap splits those mid-escape and is left to do it
+        """
+        width = self.width
+        if ('\x1b' not in text and len(text) <= width) or len(_ansi.sub('', text)) <= width:
+            return [text.rstrip(' ')]
 
-            # process normal text
+        chunks = [chunk for chunk in _spaces.split(text) if chunk]
+        chunks.reverse()
+        lines = []
 
-            # extract inline code, replace with placeholders
-            code_snippets = re.findall(r'`(.*?)`', line)
-            line = re.sub(r'`(.*?)`', '1NL1NECODE', line)
+        while chunks:
+            cur_line = []
+            cur_len = 0
 
-            line = re.sub(r'(\*\*|__)(.*?)\1', lambda m: f"\x1b[1m{m.group(2)}\x1b[0m", line)                               # bold
-            line = re.sub(r'^(#{1,6})\s*(.*)', lambda m: f"\x1b[1;35m{' ' * len(m.group(1))} {m.group(2)}\x1b[0m", line)    # headers in magenta
-            line = re.sub(r'^\s*([\*\-\+])\s+(.*)', lambda m: f"  \x1b[93m•\x1b[0m {m.group(2)}", line)                     # unordered lists
-            line = re.sub(r'^(\d+\.)\s+(.*)', lambda m: f"  \x1b[93m{m.group(1)}\x1b[0m {m.group(2)}", line)                 # ordered lists
+            # a row never starts with the spaces it was wrapped at
+            if lines and chunks[-1][0] == ' ':
+                del chunks[-1]
 
-            # replace all inline code placeholders in this line w/ real code
-            for snippet in code_snippets:
-                line = line.replace('1NL1NECODE', f"\x1b[1;36m{snippet}\x1b[0m", 1)
+            while chunks:
+                chunk = chunks[-1]
+                chunk_len = len(_ansi.sub('', chunk)) if '\x1b' in chunk else len(chunk)
+                if cur_len + chunk_len > width:
+                    if chunk_len > width:
+                        return None
+                    break
+                cur_line.append(chunks.pop())
+                cur_len += chunk_len
 
-            try:
-                width = shutil.get_terminal_size().columns
-                wrapped_text = ansiwrap_hotoffthehamster.fill(line, width=width, replace_whitespace=True, 
-                                                              drop_whitespace=True, break_on_hyphens=False)
-                output.append(wrapped_text)
-            except Exception as e:
-                print(f"Error wrapping text: {str(e)}")
-                output.append(line)
+            # or ends with them
+            if cur_line and cur_line[-1][0] == ' ':
+                del cur_line[-1]
 
-    return '\n'.join(output)  # join all members of list var into one big str, joined with newlines
+            if cur_line:
+                lines.append(''.join(cur_line))
 
+        return lines
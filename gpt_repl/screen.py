@@ -0,0 +1,125 @@
+#################################################
+## file         : screen.py
+## description  : differential terminal output,
+##                redraw only what changed
+##
+#################################################
+
+import os
+import sys
+from gpt_repl.render import LineCounter, terminal_size
+
+# terminals known to support synchronized output (mode 2026): the terminal holds the frame
+# until it's complete, so a redraw never shows half-erased lines
+sync_terminals = ("kitty", "wezterm", "iterm", "ghostty", "foot", "alacritty", "contour", "vscode", "rio")
+
+def sync_supported():
+    setting = os.environ.get("GPT_REPL_SYNC_OUTPUT", "").lower()
+    if setting in ("0", "false", "no"):
+        return False
+    if setting in ("1", "true", "yes"):
+        return True
+    term = " ".join(os.environ.get(name, "") for name in ("TERM", "TERM_PROGRAM")).lower()
+    return any(name in term for name in sync_terminals)
+
+
+class Screen:
+    """
+    a region of the terminal that starts at the cursor and grows downwards, with the cursor
+    always at the end of what was written. update() takes the full text the region should show
+    and only rewrites from the first line that changed (or, on the last line, from the first
+    character that changed), instead of clearing the region and printing it all again.
+    lines that scrolled off the top can't be rewritten, they're left as they are
+    """
+
+    def __init__(self, out=None, sync: bool = None):
+        self.out = out or sys.stdout
+        self.sync = sync_supported() if sync is None else sync
+        self.lines = [""]       # what the region shows, split on '\n'
+        self.bytes_written = 0
+
+    def write(self, text: str):
+        # append to the region
+        if not text:
+            return
+        parts = text.split('\n')
+        self.lines[-1] += parts[0]
+        self.lines.extend(parts[1:])
+        self._emit(text)
+
+    def echoed(self, text: str):
+        # account for text the terminal showed without us writing it (e.g. what input() echoes)
+        parts = text.split('\n')
+        self.lines[-1] += parts[0]
+        self.lines.extend(parts[1:])
+
+    def update(self, text: str):
+        new = text.split('\n')
+        old = self.lines
+
+        i = 0
+        last = min(len(old), len(new))
+        while i < last and old[i] == new[i]:
+            i += 1
+        if i == len(old) == len(new):
+            return
+
+        if i == len(old) - 1 and new[i].startswith(old[i]):
+            # only appended to
+            self.lines = new
+            self._emit(new[i][len(old[i]):] + ''.join('\n' + line for line in new[i + 1:]))
+            return
+
+        if i == len(old):
+            # old is a prefix of new but ended with a newline
+            self.lines = new
+            self._emit(''.join('\n' + line for line in new[i:]))
+            return
+
+        if i == len(old) - 1 == len(new) - 1 and self._plain(old[i]) and self._plain(new[i]):
+            # only the end of the last line changed: step back to the first changed column
+            common = 0
+            while common < min(len(old[i]), len(new[i])) and old[i][common] == new[i][common]:
+                common += 1
+            back = len(old[i]) - common
+            seq = '\b' * back if back <= 3 else f"\x1b[{back}D"
+            seq += new[i][common:]
+            if len(new[i]) < len(old[i]):
+                seq += "\x1b[K"
+            self.lines = new
+            self._emit(seq)
+            return
+
+        # rewrite from the start of the first changed line
+        self.lines = new
+        self._emit(self._move_to_line(old, i) + "\x1b[J" + '\n'.join(new[i:]), frame=True)
+
+    def clear(self):
+        # erase the region and put the cursor back where it started
+        if self.lines != [""]:
+            self._emit(self._move_to_line(self.lines, 0) + "\x1b[J", frame=True)
+        self.lines = [""]
+
+    def reset(self):
+        # leave what's drawn where it is and start a new region at the cursor
+        self.lines = [""]
+
+    def _move_to_line(self, lines, i: int):
+        # cursor movement from the end of the region to the first column of lines[i]
+        counter = LineCounter()
+        rows = 0
+        for line in lines[i:]:
+            rows += counter.feed(line).rows
+            counter.reset()
+        up = min(rows - 1, terminal_size().lines - 1)
+        return (f"\x1b[{up}A" if up > 0 else "") + "\r"
+
+    def _plain(self, line: str):
+        return line.isascii() and line.isprintable() and len(line) < terminal_size().columns
+
+    def _emit(self, seq: str, frame: bool = False):
+        if frame and self.sync:
+            seq = "\x1b[?2026h" + seq + "\x1b[?2026l"
+        self.bytes_written += len(seq.encode())
+        self.out.write(seq)
+        self.out.flush()
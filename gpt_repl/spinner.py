@@ -1,40 +1,127 @@
 #################################################
 ## file         : spinner.py
-## description  :
+## description  : live status line shown below a
+##                response while it's requested
+##                and streamed
 ##
 #################################################
 
 import sys
 import time
 import threading
+from gpt_repl.render import LineCounter, terminal_size
 
-class Spinner:
-    def __init__(self, message="", delay=0.1):
-        self.spinner = ['|', '/', '-', '\\']
-        self.delay = delay
-        self.message = message
+class StatusLine:
+    """
+    one line below the cursor with elapsed time, time to first token, tokens streamed and
+    tokens/sec. tokens are estimated from the text, 4 characters each like everywhere else that
+    has no tokenizer (a chunk can hold a few tokens, or none). its thread sleeps on a condition and only wakes when the stream reports
+    progress or the elapsed time needs a tick, and only writes when the text changed.
+
+    while it runs, everything printed for the response goes through write() (it's file-like,
+    so a Screen can write to it). writes and redraws share one lock, so they never interleave.
+    the cursor stays at the end of the response, the status is drawn on the row below it with
+    relative cursor moves, and it's only erased when the response is about to write over it
+    """
+
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self.cond = threading.Condition()
+        self.thread = None
         self.running = False
-        self.spinner_thread = None
-
-    def spin(self):
-        sys.stdout.write('\n')
-        sys.stdout.flush()
-        while self.running:
-            for cursor in self.spinner:
-                sys.stdout.write(f'\r{self.message} {cursor}')
-                sys.stdout.flush()
-                time.sleep(self.delay)
-                sys.stdout.write(f'\r{self.message} ')
-                sys.stdout.flush()
-
-    def start(self):
+
+    def start(self, model: str):
+        self.model = model
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.chars = 0
+        self.drawn = None       # status text on screen, or None
+        self.last_draw = 0
+        self.detached = False   # someone else (rich.live) shows the status
+        self.counter = LineCounter()
         self.running = True
-        self.spinner_thread = threading.Thread(target=self.spin)
-        self.spinner_thread.start()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
 
     def stop(self):
-        self.running = False
-        self.spinner_thread.join()
-        sys.stdout.write('\x1b[A')    # move up a line
-        sys.stdout.write("\r\x1b[0J") # clear from cursor to end of screen
-        sys.stdout.flush()
+        if not self.running:
+            return
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join()
+        with self.cond:
+            self._erase()
+            self.out.flush()
+
+    def detach(self):
+        # stop drawing, text() is still kept up to date
+        with self.cond:
+            self.detached = True
+            self._erase()
+            self.out.flush()
+
+    def token(self, delta: str):
+        with self.cond:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.chars += len(delta)
+            if time.perf_counter() - self.last_draw >= 0.1:
+                self.cond.notify()
+
+    def text(self):
+        now = time.perf_counter()
+        elapsed = now - self.started
+        if self.first_token_at is None:
+            return f"waiting for {self.model}  {elapsed:.1f}s"
+        streamed = now - self.first_token_at
+        tokens = self.chars / 4
+        rate = f"~{tokens / streamed:.1f} tok/s" if streamed > 0.05 else "- tok/s"
+        return f"{elapsed:.1f}s  ·  first token {self.first_token_at - self.started:.2f}s  ·  ~{tokens:.0f} tokens  ·  {rate}"
+
+    ### file-like ###############################
+
+    def write(self, text: str):
+        if not text:
+            return
+        with self.cond:
+            width = terminal_size().columns
+            if self.drawn is not None and ('\n' in text or self.counter.col % width + len(text) >= width):
+                # the text may reach the status row, take the status down first
+                self._erase()
+                self.out.write(text)
+                self.counter.feed(text)
+                self._draw()
+            else:
+                self.out.write(text)
+                self.counter.feed(text)
+            self.out.flush()
+
+    def flush(self):
+        pass
+
+    ### drawing ################################
+
+    def run(self):
+        with self.cond:
+            while self.running:
+                if not self.detached:
+                    self._draw()
+                    self.out.flush()
+                # tenths of a second tick while waiting, after that progress comes from token()
+                self.cond.wait(0.1 if self.first_token_at is None else 0.5)
+
+    def _draw(self):
+        width = terminal_size().columns
+        text = self.text()[:width - 1]
+        col = self.counter.col
+        if text == self.drawn or self.detached or (col and col % width == 0):
+            return  # unchanged, or the cursor is in the last column and can't come back there
+        self.out.write(f"\n\r\x1b[K\x1b[90m{text}\x1b[0m\x1b[A\x1b[{col % width + 1}G")
+        self.drawn = text
+        self.last_draw = time.perf_counter()
+
+    def _erase(self):
+        if self.drawn is not None:
+            self.out.write("\x1b[J")  # from the cursor (end of the response) to the end of the screen
+            self.drawn = None
@@ -0,0 +1,145 @@
+#################################################
+## file         : startup.py
+## description  : background warm-up of heavy
+##                modules, and the import profiler
+##                behind `gpt --startup-profile`
+##
+#################################################
+
+import os
+import sys
+import time
+import threading
+import importlib
+
+# modules the first render needs but the chat selector and prompt don't. they're imported while
+# the selector waits for a keypress; the main thread joins the import thread before it renders
+# anything, because two threads importing the same package at once can see it half-initialized
+warm_modules = {
+    "lite": ["ansiwrap_hotoffthehamster", "pygments.lexers", "pygments.formatters", "pygments.styles"],
+    "rich": ["rich.console", "rich.markdown", "rich.panel"],
+    "raw": [],
+}
+
+_warm_thread = None
+
+def warm_imports(renderer: str):
+    global _warm_thread
+    def load():
+        for name in warm_modules.get(renderer, []):
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                pass  # the real import will report it
+    _warm_thread = threading.Thread(target=load, daemon=True, name="warm-imports")
+    _warm_thread.start()
+
+
+def wait_for_warm_imports():
+    if _warm_thread is not None:
+        _warm_thread.join()
+
+
+### import profiler #########################
+
+_start = time.perf_counter()
+_profiler = None
+
+def process_start_offset():
+    # seconds between the interpreter starting and this module loading, where the os tells us
+    try:
+        with open("/proc/self/stat", "r") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK") - (time.perf_counter() - _start))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class TimedLoader:
+
+    def __init__(self, loader, profiler):
+        self.loader = loader
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.profiler.enter()
+        start = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.profiler.leave(module.__name__, time.perf_counter() - start)
+
+
+class ImportProfiler:
+    """
+    meta path finder that wraps every module's loader to time its exec_module(), much like
+    `python -X importtime`: `total` includes nested imports, `self` excludes them
+    """
+
+    def __init__(self):
+        self.records = []  # (name, self seconds, total seconds, thread name)
+        self.local = threading.local()
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    def enter(self):
+        stack = self.local.__dict__.setdefault("stack", [])
+        stack.append(0.0)  # time spent in nested imports
+
+    def leave(self, name: str, total: float):
+        stack = self.local.stack
+        nested = stack.pop()
+        if stack:
+            stack[-1] += total
+        self.records.append((name, total - nested, total, threading.current_thread().name))
+
+
+def install():
+    global _profiler
+    _profiler = ImportProfiler()
+    sys.meta_path.insert(0, _profiler)
+
+
+def profiling():
+    return _profiler is not None
+
+
+def report(top: int = 25):
+    if _profiler is None:
+        return
+    elapsed = time.perf_counter() - _start
+    records = sorted(_profiler.records, key=lambda r: r[1], reverse=True)
+    main_thread = threading.main_thread().name
+
+    print(f"\n\x1b[1m{'self':>9} {'total':>9}  module\x1b[0m")
+    for name, self_time, total, thread in records[:top]:
+        where = "" if thread == main_thread else f" \x1b[90m({thread})\x1b[0m"
+        print(f"{self_time * 1000:8.1f}ms {total * 1000:8.1f}ms  {name}{where}")
+
+    blocking = sum(r[1] for r in _profiler.records if r[3] == main_thread)
+    background = sum(r[1] for r in _profiler.records if r[3] != main_thread)
+    print(f"\n{len(records)} modules imported: {blocking * 1000:.1f}ms on the main thread, {background * 1000:.1f}ms in the background")
+
+    offset = process_start_offset()
+    if offset is not None:
+        print(f"time to first prompt: {(elapsed + offset) * 1000:.1f}ms ({offset * 1000:.1f}ms interpreter startup)")
+    else:
+        print(f"time to first prompt: {elapsed * 1000:.1f}ms (since gpt_repl started)")
+    print()
@@ -0,0 +1,215 @@
+#################################################
+## file         : store.py
+## description  : content-addressed message store,
+##                every message is kept once and a
+##                chat is a chain of nodes ending at
+##                its HEAD
+##
+#################################################
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from gpt_repl.config import get_data_dir
+
+# ~/.gpt-repl/store.db holds every message once, keyed by the sha256 of its canonical json, and
+# the nodes that chain them: a node is (parent node, message, model) and is keyed by the hash of
+# those, so two chats that start the same way share the same nodes. a chat dir only has a HEAD
+# file naming its last node, so forking or retrying a chat copies nothing.
+# rewrites of a HEAD (retry, fork) are appended to heads.log next to it, old replies stay reachable
+
+schema = """
+CREATE TABLE IF NOT EXISTS messages (
+    hash TEXT PRIMARY KEY,  -- sha256 of the message's canonical json
+    body TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS nodes (
+    hash    TEXT PRIMARY KEY,  -- sha256 of parent, message and model
+    parent  TEXT,              -- NULL for a chat's first message
+    message TEXT,
+    model   TEXT               -- the model that wrote an assistant message, NULL for the rest
+) WITHOUT ROWID;
+"""
+
+chain_query = """
+WITH RECURSIVE chain(hash, parent, message, model, depth) AS (
+    SELECT hash, parent, message, model, 0 FROM nodes WHERE hash = ?
+    UNION ALL
+    SELECT nodes.hash, nodes.parent, nodes.message, nodes.model, chain.depth + 1
+    FROM nodes JOIN chain ON nodes.hash = chain.parent
+)
+SELECT chain.hash, chain.model, messages.body FROM chain JOIN messages ON messages.hash = chain.message
+ORDER BY chain.depth DESC
+"""
+
+_local = threading.local()  # one connection per thread (the repl, the chat writer)
+_chains = {}                # chat_dir -> (head, [(node, message, model), ...]), nodes never change
+
+def open_store():
+    db = getattr(_local, "db", None)
+    if db is None:
+        db = sqlite3.connect(store_path())
+        db.execute("PRAGMA journal_mode=WAL")  # readers don't wait on the writer thread
+        db.executescript(schema)
+        _local.db = db
+    return db
+
+
+def store_path():
+    return os.path.join(get_data_dir(), "store.db")
+
+
+def canonical(message: dict):
+    return json.dumps(message, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def digest(text: str):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def node_hash(parent, message: str, model):
+    return digest(f"{parent or ''}\n{message}\n{model or ''}")
+
+
+### heads ###################################
+
+def read_head(chat_dir):
+    try:
+        with open(os.path.join(chat_dir, "HEAD"), "r") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_head(chat_dir, node: str, reason: str = None):
+    # the objects are committed before the HEAD moves, so a HEAD never names a missing node
+    old = read_head(chat_dir)
+    path = os.path.join(chat_dir, "HEAD")
+    with open(path + ".tmp", "w") as f:
+        f.write(node + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    if reason:
+        with open(os.path.join(chat_dir, "heads.log"), "a") as f:
+            f.write(f"{time.time():.0f} {old or '-'} {node} {reason}\n")
+
+
+def has_chain(chat_dir):
+    return os.path.exists(os.path.join(chat_dir, "HEAD"))
+
+
+### chains ##################################
+
+def load_chain(chat_dir):
+    # [(node, message, model), ...] from the first message to HEAD
+    head = read_head(chat_dir)
+    cached = _chains.get(chat_dir)
+    if cached and cached[0] == head:
+        return cached[1]
+    entries = []
+    if head:
+        entries = [(node, json.loads(body), model) for node, model, body in open_store().execute(chain_query, (head,))]
+    _chains[chat_dir] = (head, entries)
+    return entries
+
+
+def save_chain(chat_dir, messages, model: str = None):
+    """
+    points the chat's HEAD at `messages`. the part that matches what's saved is reused, only the
+    messages after it are stored (and only if no chat has them yet). assistant messages past
+    the match are credited to `model`. a shorter or different history (e.g. -retry) is logged.
+    returns the index of the first message that wasn't saved already
+    """
+    if not messages:
+        return 0  # a HEAD has to name a message
+    entries = load_chain(chat_dir)
+    same = 0
+    while same < min(len(entries), len(messages)) and entries[same][1] == messages[same]:
+        same += 1
+    if same == len(entries) == len(messages) and entries:
+        return same
+
+    parent = entries[same - 1][0] if same else None
+    new_entries = entries[:same]
+    message_rows, node_rows = [], []
+    for message in messages[same:]:
+        body = canonical(message)
+        message_key = digest(body)
+        message_model = model if message.get("role") == "assistant" else None
+        node = node_hash(parent, message_key, message_model)
+        message_rows.append((message_key, body))
+        node_rows.append((node, parent, message_key, message_model))
+        new_entries.append((node, message, message_model))
+        parent = node
+
+    db = open_store()
+    with db:
+        db.executemany("INSERT OR IGNORE INTO messages VALUES (?, ?)", message_rows)
+        db.executemany("INSERT OR IGNORE INTO nodes VALUES (?, ?, ?, ?)", node_rows)
+    rewritten = same < len(entries)
+    write_head(chat_dir, parent, reason="rewrite" if rewritten else None)
+    _chains[chat_dir] = (parent, new_entries)
+    return same
+
+
+def fork_chain(chat_dir, new_chat_dir, num_messages: int):
+    # the new chat's HEAD is the node after `num_messages` messages of the old one, nothing is copied
+    entries = load_chain(chat_dir)[:num_messages]
+    if not entries:
+        return
+    write_head(new_chat_dir, entries[-1][0], reason=f"fork of {os.path.basename(chat_dir)}")
+    _chains[new_chat_dir] = (entries[-1][0], entries)
+
+
+### maintenance #############################
+
+def reachable_heads(chats_dir):
+    # every HEAD, and every node a HEAD used to point at (old replies stay in heads.log)
+    heads = set()
+    for entry in os.scandir(chats_dir):
+        if not entry.is_dir():
+            continue
+        head = read_head(entry.path)
+        if head:
+            heads.add(head)
+        try:
+            with open(os.path.join(entry.path, "heads.log"), "r") as f:
+                for line in f:
+                    parts = line.split()
+                    heads.update(part for part in parts[1:3] if len(part) == 64)
+        except FileNotFoundError:
+            pass
+    return heads
+
+
+def collect_garbage(chats_dir):
+    # drops nodes and messages no chat can reach (e.g. of deleted chats), returns how many
+    db = open_store()
+    with db:
+        db.execute("CREATE TEMP TABLE IF NOT EXISTS heads (hash TEXT PRIMARY KEY)")
+        db.execute("DELETE FROM heads")
+        db.executemany("INSERT OR IGNORE INTO heads VALUES (?)", [(head,) for head in reachable_heads(chats_dir)])
+        db.execute("""
+            CREATE TEMP TABLE live AS
+            WITH RECURSIVE walk(hash) AS (
+                SELECT hash FROM heads
+                UNION
+                SELECT nodes.parent FROM nodes JOIN walk ON nodes.hash = walk.hash WHERE nodes.parent IS NOT NULL
+            ) SELECT hash FROM walk""")
+        nodes = db.execute("DELETE FROM nodes WHERE hash NOT IN (SELECT hash FROM live)").rowcount
+        messages = db.execute("DELETE FROM messages WHERE hash NOT IN (SELECT message FROM nodes)").rowcount
+        db.execute("DROP TABLE live")
+    db.execute("VACUUM")
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE)")  # VACUUM goes through the wal, give that space back too
+    _chains.clear()
+    return nodes, messages
+
+
+def store_counts():
+    db = open_store()
+    return (db.execute("SELECT COUNT(*) FROM nodes").fetchone()[0],
+            db.execute("SELECT COUNT(*) FROM messages").fetchone()[0])
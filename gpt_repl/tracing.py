@@ -0,0 +1,160 @@
+#################################################
+## file         : tracing.py
+## description  : opt-in span traces of a session
+##                (chrome trace-event json) and
+##                per-turn cProfile dumps, behind
+##                `gpt --profile`
+##
+#################################################
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+
+# checked on the hot paths, while it's False nothing is timed or recorded
+active = False
+
+_dir = None
+_origin = 0.0
+_events = []
+_threads = {}       # thread ident -> (tid, name)
+_cprofile = False
+_profile = None
+_turn = 0
+_turn_start = None
+
+def enable(cprofile: bool = False, directory: str = None):
+    """
+    start recording spans. the trace goes to <directory>/trace.json (open it in
+    ui.perfetto.dev or chrome://tracing), with cprofile each turn also gets a turn-<n>.prof
+    (`python -m pstats turn-1.prof`)
+    """
+    global active, _dir, _origin, _cprofile
+    if directory is None:
+        from gpt_repl.config import get_data_dir
+        directory = os.path.join(get_data_dir(), "profiles", time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(directory, exist_ok=True)
+    _dir = directory
+    _origin = time.perf_counter()
+    _cprofile = cprofile
+    active = True
+    atexit.register(finish)
+
+
+def event(name: str, start: float, end: float, args: dict = None):
+    # one complete span, start and end from time.perf_counter()
+    ident = threading.get_ident()
+    if ident not in _threads:
+        _threads[ident] = (len(_threads) + 1, threading.current_thread().name)
+    record = {"name": name, "ph": "X", "pid": os.getpid(), "tid": _threads[ident][0],
+              "ts": round((start - _origin) * 1e6, 1), "dur": round((end - start) * 1e6, 1)}
+    if args:
+        record["args"] = args
+    _events.append(record)
+
+
+class Span:
+
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        event(self.name, self.start, time.perf_counter(), self.args)
+        return False
+
+
+class NoSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_no_span = NoSpan()
+
+def span(name: str, **args):
+    # `with tracing.span("name"):`, the same do-nothing object every time while tracing is off
+    if not active:
+        return _no_span
+    return Span(name, args)
+
+
+def chunks(stream):
+    # iterate a streamed response with a span for each wait on the next chunk. with tracing
+    # off it's the stream itself, so the loop over it costs nothing extra
+    if not active:
+        return stream
+    return _traced_chunks(stream)
+
+
+def _traced_chunks(stream):
+    i = 0
+    iterator = iter(stream)
+    while True:
+        start = time.perf_counter()
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        event("chunk", start, time.perf_counter(), {"i": i})
+        i += 1
+        yield chunk
+
+
+### turns ##################################
+
+def start_turn():
+    global _turn, _turn_start, _profile
+    if not active:
+        return
+    end_turn()
+    _turn += 1
+    _turn_start = time.perf_counter()
+    if _cprofile:
+        import cProfile
+        _profile = cProfile.Profile()
+        _profile.enable()
+
+
+def end_turn():
+    # called again at the top of the repl loop, so turns that `continue` early still end
+    global _turn_start, _profile
+    if not active or _turn_start is None:
+        return
+    event(f"turn {_turn}", _turn_start, time.perf_counter())
+    _turn_start = None
+    if _profile:
+        _profile.disable()
+        _profile.dump_stats(os.path.join(_dir, f"turn-{_turn}.prof"))
+        _profile = None
+    write()
+
+
+def write():
+    names = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+             for tid, name in _threads.values()]
+    path = os.path.join(_dir, "trace.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump({"traceEvents": names + _events, "displayTimeUnit": "ms"}, f)
+    os.replace(path + ".tmp", path)
+
+
+def finish():
+    global active
+    if not active:
+        return
+    end_turn()
+    write()
+    active = False
+    sys.stderr.write(f"profile written to {_dir}\n")
@@ -0,0 +1,152 @@
+#################################################
+## file         : writer.py
+## description  : saves chats on a background
+##                thread, so replies and the next
+##                prompt don't wait on the disk
+##
+#################################################
+
+import os
+import sys
+import time
+import queue
+import atexit
+import signal
+import threading
+from gpt_repl import tracing
+from gpt_repl.chat import new_chat_dir, init_chat, save_chat
+from gpt_repl.metrics import percentile
+
+class ChatWriter:
+    """
+    chat writes go through one bounded queue to one thread, so each chat's writes land in the
+    order they were made. saves of the same chat that queue up together are folded into a single
+    write. a failed write doesn't stop the repl, it's kept for take_errors() to show at the next
+    prompt. with background off every write happens right away, like before
+    """
+
+    def __init__(self, background: bool = True, max_pending: int = 32):
+        self.background = background
+        self.queue = queue.Queue(max_pending)  # put() waits when this many writes are behind
+        self.thread = None
+        self.lock = threading.Lock()
+        self.errors = []
+        self.latencies = []     # seconds from each save/create to it being on disk
+        self.writes = 0         # writes done, after folding
+        self.jobs = 0           # saves/creates asked for
+        self.max_depth = 0
+
+    def create(self, model: str, user_input: str):
+        # the directory is made right away, so the path can be used (and can't be taken by
+        # another session), its files and catalog entry follow in the background
+        chat_dir = new_chat_dir(model)
+        self.submit("create", chat_dir, (model, user_input))
+        return chat_dir
+
+    def save(self, chat_dir, messages, model: str):
+        # messages is copied, the repl keeps appending to its list
+        self.submit("save", chat_dir, (list(messages), model))
+
+    def submit(self, kind: str, chat_dir, args):
+        job = (kind, chat_dir, args, time.perf_counter())
+        if not self.background:
+            self.run([job])
+            return
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.loop, daemon=True, name="chat-writer")
+            self.thread.start()
+            atexit.register(self.close)
+        self.queue.put(job)
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def flush(self):
+        # wait until everything submitted so far is on disk
+        if self.thread is not None:
+            self.queue.join()
+
+    def close(self):
+        # flush and stop the thread. errors nobody has seen yet go to stderr, there's no next prompt
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        for error in self.take_errors():
+            sys.stderr.write(error + "\n")
+
+    def take_errors(self):
+        with self.lock:
+            errors, self.errors = self.errors, []
+        return errors
+
+    ### writer thread ##########################
+
+    def loop(self):
+        while 1:
+            batch = [self.queue.get()]
+            while 1:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            jobs = [job for job in batch if job is not None]
+            if jobs:
+                self.run(jobs)
+            for _ in batch:
+                self.queue.task_done()
+            if None in batch:
+                return
+
+    def run(self, jobs):
+        for kind, chat_dir, args in fold(jobs):
+            try:
+                with tracing.span("init_chat" if kind == "create" else "save_chat"):
+                    if kind == "create":
+                        init_chat(chat_dir, *args)
+                    else:
+                        save_chat(chat_dir, *args)
+            except Exception as e:
+                with self.lock:
+                    self.errors.append(f"couldn't save chat {os.path.basename(chat_dir)}: {type(e).__name__}: {e}")
+            self.writes += 1
+        done = time.perf_counter()
+        self.jobs += len(jobs)
+        self.latencies.extend(done - submitted for *_, submitted in jobs)
+        del self.latencies[:-1000]  # enough for percentiles, not a session-long list
+
+    def summary(self):
+        if not self.jobs:
+            return "  no chat writes yet\n"
+        ms = lambda seconds: f"{seconds * 1000:.1f}ms" if seconds is not None else "-"
+        mode = "background" if self.background else "in the repl"
+        return (f"  {self.jobs} chat writes ({mode}) in {self.writes} writes to disk, "
+                f"time to disk p50 {ms(percentile(self.latencies, 50))}, p95 {ms(percentile(self.latencies, 95))}, "
+                f"max {ms(max(self.latencies))}, most queued {self.max_depth}\n")
+
+
+def fold(jobs):
+    # consecutive saves of a chat by the same model become one save of the later messages, as
+    # long as those start with the earlier ones. a save that replaces history (-retry) is kept
+    # apart, so the reply it replaces is stored and the rewrite logged. a create is never folded,
+    # the saves after it have to wait for it
+    folded = []
+    last = {}  # chat_dir -> index in folded of its latest job
+    for kind, chat_dir, args, _ in jobs:
+        i = last.get(chat_dir)
+        if kind == "save" and i is not None and folded[i][0] == "save" and folded[i][2][1] == args[1]:
+            earlier = folded[i][2][0]
+            if args[0][:len(earlier)] == earlier:
+                folded[i] = ("save", chat_dir, args)
+                continue
+        last[chat_dir] = len(folded)
+        folded.append((kind, chat_dir, args))
+    return folded
+
+
+def exit_on_signals():
+    # a terminal closing (SIGHUP) or a kill (SIGTERM) exits through sys.exit, so atexit still
+    # flushes the writer instead of the queued writes being lost
+    def on_signal(signum, frame):
+        sys.exit(128 + signum)
+    for name in ("SIGTERM", "SIGHUP"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), on_signal)